@@ -3,11 +3,13 @@
 quant_compensation_3p4w_parallel.py — Grouped, socket-aware calibration runner (final)
 
 Behavior summary:
-- Executes ONE calibration *group* per run (group = multiple STEPS).
-- For the chosen calibration group it runs the group on each socket (transport) in sequence.
-  Example: run group 1 on socket0 -> then group 1 on socket1 -> then script exits.
-- After both sockets are done for that group it increments the bookmark (current_cal_group)
-  so the next run will start the next calibration group.
+- Runs the remaining calibration *groups* (group = multiple STEPS) in one long-lived process,
+  starting at the bookmarked group.
+- For each calibration group it runs the group on every socket (transport) concurrently,
+  one worker thread per socket. Example: run group 1 on socket0 and socket1 together.
+- After both sockets are done for that group it increments the bookmark (current_cal_group), then
+  waits for the operator (Enter, or SIGNAL_FILE when USE_SIGNAL_FILE is set) before the next group.
+  Transports stay open across groups and are closed on exit.
 - poll_ready_all has 2-phase timeout + elimination (marks problematic meters persistently by GLOBAL meter numbers).
 - Progress stored at PROGRESS_FILE; problematic meters stored at PROBLEMATIC_FILE.
 - IMPORTANT: MCW / Modbus slave IDs sent to a socket are rebased to that socket's local meter IDs
@@ -16,12 +18,21 @@ Behavior summary:
 
 import os
 import time
-import re
 import json
+import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import config
 import steps
 from transport import get_transport
+from mcw_parse import split_segments, extract_meter_and_payload, decode_escapes, decode_hex
+
+try:
+    import orjson  # optional: much faster JSON encoder
+except ImportError:
+    orjson = None
 
 # ---------------- Constants ----------------
 ADDR_9601 = 0x2580
@@ -38,15 +49,60 @@ PROBLEMATIC_FILE = os.path.join(LOG_DIR, "problematic_meters.json")
 # Behavior tunables
 METERS_PER_SOCKET = getattr(config, "METERS_PER_SOCKET", 10)
 COMMAND_GAP = getattr(config, "COMMAND_GAP", 0.3)
+# Unattended runs: wait for the operator's signal file instead of console Enter between groups
+USE_SIGNAL_FILE = getattr(config, "USE_SIGNAL_FILE", False)
+SIGNAL_FILE = os.path.join(LOG_DIR, "calmet_ready.signal")
+
+# Guards progress / problematic bookkeeping shared by the per-socket workers
+_STATE_LOCK = threading.Lock()
 
 # ---------------- Helpers: logging & JSON -----------------
+_LOG_FH = None
+_LOG_LOCK = threading.Lock()
+
+def _flush_log():
+    if _LOG_FH:
+        _LOG_FH.flush()
+
+atexit.register(_flush_log)
+
 def log(msg: str):
+    global _LOG_FH
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{ts}] {msg}"
     print(line)
-    os.makedirs(LOG_DIR, exist_ok=True)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+    with _LOG_LOCK:
+        # One buffered handle for the whole run instead of open/append/close per line
+        if _LOG_FH is None:
+            os.makedirs(LOG_DIR, exist_ok=True)
+            _LOG_FH = open(LOG_FILE, "a", encoding="utf-8", buffering=1 << 16)
+        _LOG_FH.write(line + "\n")
+
+_LAST_WRITTEN = {}  # path -> JSON bytes last persisted
+
+def _dumps(obj) -> bytes:
+    """Compact JSON as bytes; orjson when installed, stdlib json otherwise."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+def _atomic_write_json(path, obj) -> bool:
+    """
+    Write obj as JSON via a temp file + os.replace, so a crash never leaves a half-written file.
+    Skips the write when the content is unchanged since the last save; returns True if written.
+    """
+    data = _dumps(obj)
+    if _LAST_WRITTEN.get(path) == data:
+        return False
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _LAST_WRITTEN[path] = data
+    return True
 
 def load_progress():
     if os.path.exists(PROGRESS_FILE):
@@ -58,9 +114,7 @@ def load_progress():
     return {"current_cal_group": 1}
 
 def save_progress(progress):
-    os.makedirs(LOG_DIR, exist_ok=True)
-    with open(PROGRESS_FILE, "w") as f:
-        json.dump(progress, f, indent=2)
+    _atomic_write_json(PROGRESS_FILE, progress)
 
 def load_problematic():
     if os.path.exists(PROBLEMATIC_FILE):
@@ -73,51 +127,55 @@ def load_problematic():
     return set()
 
 def save_problematic(problematic_set):
-    os.makedirs(LOG_DIR, exist_ok=True)
     lst = sorted(int(x) for x in problematic_set)
-    with open(PROBLEMATIC_FILE, "w") as f:
-        json.dump(lst, f, indent=2)
-    log(f"Saved problematic meters: {lst}")
+    if _atomic_write_json(PROBLEMATIC_FILE, lst):
+        log(f"Saved problematic meters: {lst}")
 
 # ---------------- Decoder / comm utilities -----------------
-def split_segments(raw_data):
-    if isinstance(raw_data, bytes):
-        raw_data = raw_data.decode("latin1", errors="ignore")
-    return [seg for seg in raw_data.strip().split("\r") if seg.strip()]
-
-def extract_meter_and_payload(segment: str):
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    if m:
-        return int(m.group(1)), m.group(2)
-    return None, None
-
-def decode_escapes(payload: str) -> str:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        elif payload[i] == "<":
-            match = re.match(r"<(\d{3})>", payload[i:])
-            if match:
-                value = int(match.group(1))
-                if 128 <= value <= 255:
-                    out.append(value)
-                    i += len(match.group(0))
-                    continue
-        out.append(ord(payload[i]))
-        i += 1
-    return out.hex().upper()
+@functools.lru_cache(maxsize=1024)
+def expected_response_len(mcw_cmd: str):
+    """
+    Length in bytes (CRC included) of the Modbus reply to an outgoing MCW command, derived from
+    the request itself: 0x03/0x04 -> 5 + 2*reg_count, 0x10 -> 8. None if not a fixed-length request.
+    """
+    _, sep, body = mcw_cmd.partition(",")
+    if not sep:
+        return None
+    pdu = decode_escapes(body)
+    if len(pdu) < 6:
+        return None
+    func = pdu[1]
+    if func in (0x03, 0x04):
+        return 5 + 2 * ((pdu[4] << 8) | pdu[5])
+    if func == 0x10:
+        return 8
+    return None
+
+def replies_complete(raw, expected_by_local: dict) -> bool:
+    """
+    True once every local id in expected_by_local has a full reply frame in raw.
+    A Modbus exception reply (function code | 0x80) also counts as complete; an expected
+    length of None means any reply from that meter is enough.
+    """
+    got = {}
+    for seg in split_segments(raw):
+        meter_id, payload = extract_meter_and_payload(seg)
+        if meter_id in expected_by_local and payload:
+            got[meter_id] = got.get(meter_id, b"") + decode_escapes(payload)
+    for local_id, expected in expected_by_local.items():
+        frame = got.get(local_id)
+        if not frame:
+            return False
+        if expected is None or len(frame) >= expected:
+            continue
+        if len(frame) >= 5 and frame[1] & 0x80:
+            continue
+        return False
+    return True
+
+def _mcw_local_id(mcw_cmd: str):
+    head = mcw_cmd.partition(",")[0]
+    return int(head[3:]) if head.startswith("MCW") and head[3:].isdigit() else None
 
 def send_and_log(transport, mcw_cmd: str, description: str = "", local_meter_id: int | None = None, global_meter: int | None = None):
     """
@@ -133,43 +191,90 @@ def send_and_log(transport, mcw_cmd: str, description: str = "", local_meter_id:
     transport.send_mcw(mcw_cmd)
     #time.sleep(COMMAND_GAP)
 
-    raw = transport.recv_all(2.0)
+    # Stop reading as soon as the reply is complete; only unknown commands wait out recv_all
+    mcw_local = _mcw_local_id(mcw_cmd)
+    expected = expected_response_len(mcw_cmd)
+    if mcw_local and expected:
+        raw = transport.recv_until(lambda data: replies_complete(data, {mcw_local: expected}), 2.0)
+    else:
+        raw = transport.recv_all(2.0)
 
     if not raw:
         log(f"{prefix}RECV: (no response)")
         return ""
 
-    segments = split_segments(raw)
     decoded_segments = []
 
-    for seg in segments:
-        log(f"{prefix}RECV RAW: {seg}")
+    for seg in split_segments(raw):
+        log(f"{prefix}RECV RAW: {seg.decode('latin1')}")
         meter_id, payload = extract_meter_and_payload(seg)
         if meter_id and payload:
-            decoded = decode_escapes(payload)
+            decoded = decode_hex(payload)
             decoded_segments.append(decoded)
             log(f"{prefix}DECODED: {decoded}")
 
     return "".join(decoded_segments)
 
+def send_batch_and_log(transport, cmds_by_local: dict, description: str = "", global_by_local: dict | None = None,
+                       timeout: float = 2.0):
+    """
+    Pipelined variant of send_and_log: sends the commands for several local meters back-to-back,
+    then reads until every reply is complete (or timeout) and routes each F<id> segment
+    to its local meter id.
+    Returns dict local_id -> decoded hex string (meters that did not answer are absent).
+    """
+    global_by_local = global_by_local or {}
+    for local_id, mcw_cmd in cmds_by_local.items():
+        prefix = f"G{global_by_local[local_id]} " if local_id in global_by_local else ""
+        log(f"{prefix}L{local_id} SEND ({description}): {mcw_cmd}")
+    transport.send_mcw_batch(list(cmds_by_local.values()))
+
+    expected_by_local = {local_id: expected_response_len(cmd) for local_id, cmd in cmds_by_local.items()}
+    raw = transport.recv_until(lambda data: replies_complete(data, expected_by_local), timeout)
+
+    decoded_by_local = {}
+    for seg in split_segments(raw):
+        meter_id, payload = extract_meter_and_payload(seg)
+        text = seg.decode("latin1")
+        log(f"L{meter_id} RECV RAW: {text}" if meter_id else f"RECV RAW: {text}")
+        if meter_id in cmds_by_local and payload:
+            decoded = decode_hex(payload)
+            decoded_by_local[meter_id] = decoded_by_local.get(meter_id, "") + decoded
+            log(f"L{meter_id} DECODED: {decoded}")
+
+    missing = [l for l in cmds_by_local if l not in decoded_by_local]
+    if missing:
+        log(f"RECV: (no response) for local IDs {missing}")
+    return decoded_by_local
+
 # ---------------- Command helpers (write/read) -----------------
+# Frames depend only on (local_id, register, value) and the set is tiny, so build each one
+# (float packing + CRC + escaping) once and reuse it across steps and poll rounds.
+@functools.lru_cache(maxsize=1024)
+def write_float_cmd(local_id: int, addr: int, value) -> str:
+    return steps.build_modbus_write_multiple_float(local_id, SLAVE_ID, addr, [value])
+
+@functools.lru_cache(maxsize=1024)
+def read_cmd(local_id: int, addr: int, reg_count: int = 2) -> str:
+    return steps.build_modbus_read_cmd(local_id, SLAVE_ID, addr, reg_count)
+
 def write_code_local(transport, local_id: int, code: int, wait_sec: int = 7):
     """
     Write modbus code to a meter using local meter id (1..N for that socket).
     """
-    cmd = steps.build_modbus_write_multiple_float(local_id, SLAVE_ID, ADDR_9601, [code])
+    cmd = write_float_cmd(local_id, ADDR_9601, code)
     send_and_log(transport, cmd, f"write code {code}", local_meter_id=local_id)
     if wait_sec > 0:
         log(f"L{local_id}: Waiting {wait_sec}s...")
         time.sleep(wait_sec)
 
 def write_cal_done_local(transport, local_id: int):
-    cmd = steps.build_modbus_write_multiple_float(local_id, SLAVE_ID, REG_CAL_DONE, [1])
+    cmd = write_float_cmd(local_id, REG_CAL_DONE, 1)
     send_and_log(transport, cmd, "update calibration done status", local_meter_id=local_id)
     time.sleep(0.5)
 
 def read_cal_status_local(transport, local_id: int):
-    cmd = steps.build_modbus_read_cmd(local_id, SLAVE_ID, REG_CAL_DONE, 2)
+    cmd = read_cmd(local_id, REG_CAL_DONE, 2)
     resp = send_and_log(transport, cmd, "read calibration status", local_meter_id=local_id)
     # Try to parse last 4 hex digits if present; if not, return -1
     try:
@@ -182,42 +287,60 @@ def read_cal_status_local(transport, local_id: int):
     return -1
 
 # ---------------- Poll with elimination (accepts list of (global, local)) -----------------
-def poll_ready_all_localpairs(transport, global_local_pairs, delay=1.2, first_phase=30, second_phase=40):
+def poll_ready_all_localpairs(transport, global_local_pairs, initial_interval=0.2, max_interval=2.0,
+                              first_phase=30, second_phase=40):
     """
     Poll until READY_RESPONSE is seen for each local meter.
     Accepts `global_local_pairs` = list of (global_meter_num, local_meter_id)
+    Each meter is polled on its own exponential backoff (initial_interval doubling up to max_interval),
+    so busy meters are read less often while freshly started ones are checked densely.
     Returns: set of problematic global meter numbers (those not ready after both phases).
     """
     start_time = time.time()
-    pending = {local: global_ for (global_, local) in global_local_pairs}  # map local -> global
+    # map local -> {"global", "next_poll", "interval"}
+    pending = {local: {"global": global_, "next_poll": start_time, "interval": initial_interval}
+               for (global_, local) in global_local_pairs}
     problematic = set()
 
     total_timeout = first_phase + second_phase
-    log(f"Start polling local meters {sorted(pending.keys())} (global mapping: {pending}) total timeout {total_timeout}s")
+    deadline = start_time + total_timeout
+    log(f"Start polling local meters {sorted(pending.keys())} "
+        f"(global mapping: { {l: e['global'] for l, e in pending.items()} }) total timeout {total_timeout}s")
 
     while pending:
         elapsed = time.time() - start_time
 
         if elapsed > total_timeout:
             log(f"Timeout reached ({total_timeout}s). Remaining local IDs not ready: {sorted(pending.keys())}")
-            problematic.update(pending.values())  # add remaining global numbers
+            problematic.update(e["global"] for e in pending.values())  # add remaining global numbers
             break
         elif elapsed > first_phase:
             log(f"Elimination mode for remaining local IDs: {sorted(pending.keys())} (extra {second_phase - (elapsed - first_phase):.1f}s left)")
 
-        for local_id in list(pending.keys()):
-            cmd = steps.build_modbus_read_cmd(local_id, SLAVE_ID, REG_CAL_DONE, 2)
-            decoded = send_and_log(transport, cmd, "poll ready", local_meter_id=local_id, global_meter=pending[local_id])
-
-            if READY_RESPONSE in decoded:
-                log(f"L{local_id} (G{pending[local_id]}) ready.")
-                pending.pop(local_id, None)
-            else:
-                log(f"L{local_id} (G{pending[local_id]}) still busy / no ready response.")
-                time.sleep(1.0)
+        # Submit the reads for every meter that is due, then reap all replies in one pass
+        now = time.time()
+        due = [local_id for local_id, e in pending.items() if now >= e["next_poll"]]
+        if due:
+            cmds = {local_id: read_cmd(local_id, REG_CAL_DONE, 2) for local_id in due}
+            decoded_by_local = send_batch_and_log(transport, cmds, "poll ready",
+                                                  global_by_local={l: pending[l]["global"] for l in due})
+
+            now = time.time()
+            for local_id in due:
+                entry = pending[local_id]
+                if READY_RESPONSE in decoded_by_local.get(local_id, ""):
+                    log(f"L{local_id} (G{entry['global']}) ready after {now - start_time:.1f}s.")
+                    pending.pop(local_id, None)
+                else:
+                    entry["interval"] = min(entry["interval"] * 2, max_interval)
+                    entry["next_poll"] = now + entry["interval"]
+                    log(f"L{local_id} (G{entry['global']}) still busy / no ready response "
+                        f"(next poll in {entry['interval']:.1f}s).")
 
         if pending:
-            time.sleep(delay)
+            # Sleep until the earliest meter is due again (never past the overall deadline)
+            wake_at = min(min(e["next_poll"] for e in pending.values()), deadline)
+            time.sleep(max(0.0, wake_at - time.time()))
 
     if problematic:
         log(f"Marked problematic (global) meters: {sorted(problematic)}")
@@ -254,12 +377,19 @@ CAL_GROUPS = [
 ]
 
 # ---------------- Helpers: sockets <-> meter ranges -----------------
-def get_all_socket_entries():
-    """Return list of socket tuples from config (ip,port)."""
+def _load_socket_entries():
     if hasattr(config, "METER_CONNECTIONS") and config.METER_CONNECTIONS:
-        return list(config.METER_CONNECTIONS)
-    return [(getattr(config, "SOCKET_IP", "192.168.100.100"),
-             getattr(config, "SOCKET_PORT", 12345))]
+        return tuple(tuple(s) for s in config.METER_CONNECTIONS)
+    return ((getattr(config, "SOCKET_IP", "192.168.100.100"),
+             getattr(config, "SOCKET_PORT", 12345)),)
+
+# Socket table is fixed for the run: resolve it once and index it by (ip, port)
+_SOCKETS = _load_socket_entries()
+_SOCKET_INDEX = {s: i for i, s in enumerate(_SOCKETS)}
+
+def get_all_socket_entries():
+    """Return tuple of socket tuples from config (ip,port)."""
+    return _SOCKETS
 
 def meters_for_socket_index(idx):
     """Return list of GLOBAL meter numbers assigned to socket index (0-based)."""
@@ -278,17 +408,17 @@ def calibrate_group_on_socket(transport, socket_ip_port, group_steps, problemati
     - All sends to transport use LOCAL meter IDs (1..N for that socket).
     Returns a set of newly discovered problematic GLOBAL meters.
     """
-    sockets = get_all_socket_entries()
     ip, port = socket_ip_port
-    idx = sockets.index((ip, port))
+    idx = _SOCKET_INDEX[(ip, port)]
     global_meter_list = meters_for_socket_index(idx)
     if not global_meter_list:
         log(f"No meters assigned to socket {ip}:{port}")
         return set()
 
     # map global -> local (local numbering starts at 1)
-    global_to_local = {g: (g - global_meter_list[0] + 1) for g in global_meter_list}
-    active_pairs = [(g, global_to_local[g]) for g in global_meter_list if g not in problematic_set]
+    skip = frozenset(problematic_set)
+    first = global_meter_list[0]
+    active_pairs = [(g, g - first + 1) for g in global_meter_list if g not in skip]
 
     if not active_pairs:
         log(f"All meters on {ip}:{port} are marked problematic or skipped; nothing to do.")
@@ -299,26 +429,27 @@ def calibrate_group_on_socket(transport, socket_ip_port, group_steps, problemati
 
     for step in group_steps:
         log(f"Step: {step['desc']}")
-        # input_change steps: operator must set Calmet properly BEFORE we proceed with this socket
-        if step.get("input_change"):
-            log("Please ensure Calmet is set as required for this step for this socket.")
-            input("Press Enter to continue after setting Calmet input for this socket...")
+        # input_change steps are not prompted here: this runs on one worker thread per socket,
+        # so run_group prompts once for the whole group before any socket starts
 
         if step.get("busy_poll"):
             # busy_poll requires we first optionally send a code to all active local IDs (if step has code)
             if isinstance(step.get("code"), int):
                 code = step["code"]
-                for g, local in list(active_pairs):
-                    send_and_log(transport, steps.build_modbus_write_multiple_float(local, SLAVE_ID, ADDR_9601, [code]),
-                                 f"pre-busy write code {code}", local_meter_id=local, global_meter=g)
-                    time.sleep(step.get("wait", 0))
-            time.sleep(7)
-            # Now poll until ready: we need to use list of (global, local)
-            problematic_here = poll_ready_all_localpairs(transport, active_pairs)
+                # One pipelined burst of writes to every active meter, then a single meter-side settle
+                cmds = {local: write_float_cmd(local, ADDR_9601, code) for _, local in active_pairs}
+                send_batch_and_log(transport, cmds, f"pre-busy write code {code}",
+                                   global_by_local={local: g for g, local in active_pairs})
+                time.sleep(step.get("wait", 0))
+            # Poll straight away instead of a blanket 7s settle; the backoff keeps early polls cheap,
+            # and the 7s is added to the first phase so the overall deadline is unchanged.
+            problematic_here = poll_ready_all_localpairs(transport, active_pairs, initial_interval=0.5,
+                                                         first_phase=30 + 7)
             if problematic_here:
                 new_problematic.update(problematic_here)
-                # update active_pairs to remove newly problematic meters
-                active_pairs = [(g, l) for (g, l) in active_pairs if g not in new_problematic]
+                # drop only the meters that just failed from active_pairs
+                failed_here = frozenset(problematic_here)
+                active_pairs = [p for p in active_pairs if p[0] not in failed_here]
         else:
             # Non-busy steps: either write code or nothing (apply input)
             code = step.get("code")
@@ -327,14 +458,111 @@ def calibrate_group_on_socket(transport, socket_ip_port, group_steps, problemati
                 for g, local in list(active_pairs):
                     write_code_local(transport, local, code, wait_sec=wait)
             elif code is None:
-                # input-change or purely operator step; nothing to send (we prompted above if input_change)
+                # input-change or purely operator step; nothing to send (run_group prompted for input_change)
                 pass
 
     return new_problematic
 
+# ---------------- Operator barrier & transport cache -----------------
+def wait_for_operator(message: str):
+    """
+    Block until the operator is ready to continue.
+    With config.USE_SIGNAL_FILE the driver waits for SIGNAL_FILE to appear (created by the operator
+    UI or `type nul > ...`), so unattended runs need no console; otherwise it waits for Enter.
+    """
+    log(message)
+    if not USE_SIGNAL_FILE:
+        input("Press Enter to continue...")
+        return
+    log(f"Waiting for signal file {SIGNAL_FILE} ...")
+    while not os.path.exists(SIGNAL_FILE):
+        time.sleep(0.2)
+    try:
+        os.remove(SIGNAL_FILE)
+    except OSError:
+        pass
+
+_TRANSPORTS = {}  # (ip, port) -> open transport, kept across groups
+
+def _get_cached_transport(ip, port):
+    with _STATE_LOCK:
+        transport = _TRANSPORTS.get((ip, port))
+        if transport is None:
+            log(f"Opening transport {ip}:{port}")
+            transport = get_transport(ip, port)
+            _TRANSPORTS[(ip, port)] = transport
+        return transport
+
+def _drop_cached_transport(ip, port):
+    with _STATE_LOCK:
+        transport = _TRANSPORTS.pop((ip, port), None)
+    if transport:
+        try:
+            transport.close()
+        except Exception:
+            pass
+
+def close_all_transports():
+    for (ip, port) in list(_TRANSPORTS):
+        _drop_cached_transport(ip, port)
+
+atexit.register(close_all_transports)
+
 # ---------------- Main orchestration -----------------
+def _run_one_socket(ip, port, current_group, group_steps, problematic, progress, done_key):
+    """Run the group on one socket (reusing its open transport) and record the outcome."""
+    try:
+        transport = _get_cached_transport(ip, port)
+        with _STATE_LOCK:
+            skip = set(problematic)
+        new_problems = calibrate_group_on_socket(transport, (ip, port), group_steps, skip)
+        with _STATE_LOCK:
+            if new_problems:
+                problematic.update(new_problems)
+                save_problematic(problematic)
+            # mark socket done for this group
+            progress[done_key] = True
+            save_progress(progress)
+        log(f"Completed group {current_group} on {ip}:{port}")
+    except Exception as exc:
+        log(f"Error while processing {ip}:{port}: {exc}")
+        # do not mark as done; reconnect next time this socket is used
+        _drop_cached_transport(ip, port)
+
+def per_socket_done_key(ip, port, grp):
+    return f"group_{grp}_socket_{ip.replace('.','_')}_{port}_done"
+
+def run_group(current_group, sockets, progress, problematic) -> bool:
+    """Run one calibration group on every socket not yet done. Returns True if all sockets completed."""
+    group_steps = CAL_GROUPS[current_group - 1]
+
+    # Prompt operator once BEFORE touching the sockets if this group includes an input_change step.
+    # This is the only input_change prompt: the sockets then run concurrently, and a prompt per
+    # worker thread would ask twice at once (one Enter / signal file releasing only one of them).
+    if any(s.get("input_change", False) for s in group_steps):
+        wait_for_operator("This calibration group requires Calmet input change BEFORE running on sockets.")
+
+    todo = []
+    for (ip, port) in sockets:
+        key = per_socket_done_key(ip, port, current_group)
+        if progress.get(key):
+            log(f"Skipping {ip}:{port} for group {current_group} (already done previously).")
+            continue
+        todo.append((ip, port, key))
+
+    # Sockets drive disjoint meter sets over independent connections, so run them side by side
+    if todo:
+        with ThreadPoolExecutor(max_workers=len(todo)) as ex:
+            futures = [ex.submit(_run_one_socket, ip, port, current_group, group_steps, problematic, progress, key)
+                       for (ip, port, key) in todo]
+            for f in futures:
+                f.result()
+
+    # Check completion across all sockets
+    return all(progress.get(per_socket_done_key(ip, port, current_group)) for (ip, port) in sockets)
+
 def run_quant_compensation_3p4w():
-    log("=== Starting 3P4W Quant Compensation Calibration (grouped per run) ===")
+    log("=== Starting 3P4W Quant Compensation Calibration (grouped, persistent run) ===")
 
     sockets = get_all_socket_entries()
     if not sockets:
@@ -355,61 +583,29 @@ def run_quant_compensation_3p4w():
         save_progress(progress)
 
     log(f"Resuming at calibration group {current_group} of {len(CAL_GROUPS)}")
-    group_steps = CAL_GROUPS[current_group - 1]
 
-    # Prompt operator once BEFORE opening transports if this group includes an initial input_change step.
-    if any(s.get("input_change", False) for s in group_steps):
-        log("This calibration group requires Calmet input change BEFORE running on sockets.")
-        input("Apply Calmet input for this group now, then press Enter to continue...")
-
-    per_socket_done_key = lambda ip, port, grp: f"group_{grp}_socket_{ip.replace('.','_')}_{port}_done"
-
-    for (ip, port) in sockets:
-        key = per_socket_done_key(ip, port, current_group)
-        if progress.get(key):
-            log(f"Skipping {ip}:{port} for group {current_group} (already done previously).")
-            continue
-
-        transport = None
-        try:
-            log(f"Opening transport {ip}:{port}")
-            transport = get_transport(ip, port)
-            new_problems = calibrate_group_on_socket(transport, (ip, port), group_steps, problematic)
-            if new_problems:
-                problematic.update(new_problems)
-                save_problematic(problematic)
-            # mark socket done for this group
-            progress[key] = True
-            save_progress(progress)
-            log(f"Completed group {current_group} on {ip}:{port}")
-        except Exception as exc:
-            log(f"Error while processing {ip}:{port}: {exc}")
-            # do not mark as done; operator can re-run later
-        finally:
-            if transport:
-                try:
-                    transport.close()
-                except Exception:
-                    pass
+    try:
+        # One long-lived process walks the remaining groups; transports stay open between them
+        while True:
+            if not run_group(current_group, sockets, progress, problematic):
+                log("Not all sockets completed for this group. Re-run the script to continue remaining sockets.")
+                break
 
-    # Check completion across all sockets
-    done_flags = [progress.get(per_socket_done_key(ip, port, current_group)) for (ip, port) in sockets]
-    if all(bool(f) for f in done_flags):
-        # advance bookmark
-        if current_group < len(CAL_GROUPS):
-            progress["current_cal_group"] = current_group + 1
-            save_progress(progress)
             log(f"Calibration group {current_group} completed across all sockets.")
-            log(f"Please change Calmet input as per next group's requirements and re-run the script to continue (it will start group {current_group + 1}).")
-        else:
-            log("All calibration groups completed across all sockets.")
-            log(f"Problematic meters (if any) saved at: {PROBLEMATIC_FILE}" if os.path.exists(PROBLEMATIC_FILE) else "No problematic meters recorded.")
-            # Optionally keep progress or remove it — leaving it is safer.
-        log("Exiting now. Restart the script after making the required Calmet changes.")
-        raise SystemExit(0)
-    else:
-        log("Not all sockets completed for this group. Re-run the script to continue remaining sockets.")
-        raise SystemExit(0)
+            if current_group >= len(CAL_GROUPS):
+                log("All calibration groups completed across all sockets.")
+                log(f"Problematic meters (if any) saved at: {PROBLEMATIC_FILE}" if os.path.exists(PROBLEMATIC_FILE) else "No problematic meters recorded.")
+                # Optionally keep progress or remove it — leaving it is safer.
+                break
+
+            # advance bookmark (so a crash or Ctrl+C resumes at the next group)
+            current_group += 1
+            progress["current_cal_group"] = current_group
+            save_progress(progress)
+            wait_for_operator(f"Please change Calmet input as per group {current_group}'s requirements.")
+    finally:
+        close_all_transports()
+    raise SystemExit(0)
 
 if __name__ == "__main__":
-    run_quant_compensation_3p4w()
\ No newline at end of file
+    run_quant_compensation_3p4w()
@@ -8,54 +8,23 @@ Read Parameters Script (Full & Reliable)
     * 1–10  → 192.168.100.100
     * 11–20 → 192.168.100.101
 - Always sends MCW1..10 (never MCW11+).
-- Waits 3 seconds after switching IP/port.
+- Opens one connection per IP and reads all of its meters over it.
 - Decodes full 9-float frame per read (voltage, current, watt, etc.).
 - Validates and saves results into a single JSON file (rewritten each run).
 """
 
 import os
-import re
-import json
 import time
 import struct
-from typing import Dict, List, Tuple
+import atexit
+import functools
+from typing import Dict, List
 
 import config
 from transport import get_transport
 from steps import build_modbus_read_cmd
-
-# ==========================================================
-# Decoder helpers
-# ==========================================================
-def split_segments(raw_bytes: bytes) -> List[str]:
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-def extract_meter_and_payload(segment: str) -> Tuple[int, str]:
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    return (int(m.group(1)), m.group(2)) if m else (None, None)
-
-def decode_escapes(payload: str) -> bytes:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        out.append(ord(payload[i]))
-        i += 1
-    return bytes(out)
+from mcw_parse import split_segments, extract_meter_and_payload, decode_escapes
+from jsonio import write_json, load_json_cached
 
 # ==========================================================
 # Parameter map
@@ -67,20 +36,44 @@ PARAM_REGS = [
     ("frequency",  0x0046),
 ]
 
+# One contiguous block covering every register above (2 registers per float)
+BLOCK_START = 0x0000
+BLOCK_COUNT = max(addr for _, addr in PARAM_REGS) + 2 - BLOCK_START
+# Decode the whole block in one call, then pick each parameter by its float index
+_BLOCK_FLOATS = struct.Struct(f">{BLOCK_COUNT // 2}f")
+# Single-float reads (fallback path) use a precompiled decoder as well
+_F32_BE_FROM = struct.Struct(">f").unpack_from
+_PARAM_INDEX = tuple((name, (addr - BLOCK_START) // 2) for name, addr in PARAM_REGS)
+
 
 # ==========================================================
 # Validation
 # ==========================================================
+def _limits_for(name: str):
+    """(min, max) allowed for a parameter, or None if it has no range check."""
+    if "voltage" in name:
+        return (220.0, 240.0)
+    if "current" in name:
+        return (4.0, 5.5)
+    if "watt" in name:
+        return (0.0, 1500.0)
+    return None
+
+# Resolved once per parameter, so each read is one lookup + one comparison
+_PARAM_LIMITS = {name: _limits_for(name) for name, _ in PARAM_REGS}
+
 def validate_value(name: str, value: float) -> bool:
     if value is None:
         return False
-    if "voltage" in name and not (220.0 <= value <= 240.0):
-        return False
-    if "current" in name and not (4.0 <= value <= 5.5):
-        return False
-    if "watt" in name and not (0.0 <= value <= 1500.0):
-        return False
-    return True
+    lim = _PARAM_LIMITS[name] if name in _PARAM_LIMITS else _limits_for(name)
+    return lim is None or lim[0] <= value <= lim[1]
+
+# ==========================================================
+# Cached read commands (one frame per (meter, register, count))
+# ==========================================================
+@functools.lru_cache(maxsize=256)
+def read_cmd(local_id: int, reg_addr: int, reg_count: int) -> str:
+    return build_modbus_read_cmd(local_id, 1, start_addr=reg_addr, reg_count=reg_count)
 
 # ==========================================================
 # Read individual parameter
@@ -89,15 +82,12 @@ def read_single_param(transport, local_id: int, param_name: str, reg_addr: int,
     """
     Sends a separate read for a single parameter (float, 2 registers = 4 bytes)
     """
-    cmd = build_modbus_read_cmd(local_id, 1, start_addr=reg_addr, reg_count=2)  # 2 registers = 1 float
+    cmd = read_cmd(local_id, reg_addr, 2)  # 2 registers = 1 float
     for attempt in range(retries):
         transport.send_mcw(cmd)
         raw = transport.recv_all(timeout=config.SOCKET_TIMEOUT)
         if raw:
-            segments = split_segments(raw)
-            for seg in segments:
-                if seg.startswith(f"MCW{local_id}"):
-                    continue
+            for seg in split_segments(raw):
                 m_id, payload = extract_meter_and_payload(seg)
                 if m_id != local_id or not payload:
                     continue
@@ -107,9 +97,8 @@ def read_single_param(transport, local_id: int, param_name: str, reg_addr: int,
                 byte_count = frame[2]
                 if byte_count < 4:
                     continue
-                data = frame[3:3+4]
                 try:
-                    val = struct.unpack(">f", data)[0]
+                    val = _F32_BE_FROM(frame, 3)[0]  # float right after the 3-byte header
                     if validate_value(param_name, val):
                         return {"value": val}
                     else:
@@ -120,12 +109,48 @@ def read_single_param(transport, local_id: int, param_name: str, reg_addr: int,
     return {"value": None, "error": "no_response"}
 
 # ==========================================================
-# Read all parameters individually
+# Read all parameters in one block
 # ==========================================================
+def read_meter_block(transport, local_id: int, retries: int = 3):
+    """
+    Reads BLOCK_COUNT registers starting at BLOCK_START in a single transaction.
+    Returns the register data bytes, or None if no complete frame arrived.
+    """
+    cmd = read_cmd(local_id, BLOCK_START, BLOCK_COUNT)
+    data_len = BLOCK_COUNT * 2
+    for attempt in range(retries):
+        transport.send_mcw(cmd)
+        raw = transport.recv_all(timeout=config.SOCKET_TIMEOUT)
+        if raw:
+            for seg in split_segments(raw):
+                m_id, payload = extract_meter_and_payload(seg)
+                if m_id != local_id or not payload:
+                    continue
+                frame = decode_escapes(payload)
+                if len(frame) < 3 + data_len or frame[2] < data_len:
+                    continue
+                return frame[3:3 + data_len]
+        time.sleep(0.2)
+    return None
+
 def read_meter(transport, local_id: int, global_id: int) -> Dict:
     res = {"global_meter": global_id, "local_meter": local_id, "params": {}}
-    for param_name, reg_addr in PARAM_REGS:
-        res["params"][param_name] = read_single_param(transport, local_id, param_name, reg_addr)
+    data = read_meter_block(transport, local_id)
+    if data is None:
+        # Fall back to one transaction per parameter
+        print(f"[WARN] Block read failed for MCW{local_id}, reading parameters individually")
+        for param_name, reg_addr in PARAM_REGS:
+            res["params"][param_name] = read_single_param(transport, local_id, param_name, reg_addr)
+        return res
+
+    floats = _BLOCK_FLOATS.unpack(data)
+    for param_name, idx in _PARAM_INDEX:
+        val = floats[idx]
+        lim = _PARAM_LIMITS[param_name]
+        if lim is None or lim[0] <= val <= lim[1]:
+            res["params"][param_name] = {"value": val}
+        else:
+            res["params"][param_name] = {"value": val, "warning": "out_of_range"}
     return res
 
 # ==========================================================
@@ -136,15 +161,43 @@ def get_ip_and_local(global_meter: int):
         return "192.168.100.100", ((global_meter - 1) % 10) + 1
     return "192.168.100.101", ((global_meter - 1) % 10) + 1
 
+# ==========================================================
+# Transport cache (one warm connection per IP for the whole process)
+# ==========================================================
+_TRANSPORTS = {}
+
+def _get_or_open(ip: str, port: int):
+    transport = _TRANSPORTS.get((ip, port))
+    if transport is None:
+        print(f"[INFO] Connecting to {ip}")
+        transport = _TRANSPORTS[(ip, port)] = get_transport(ip=ip, port=port)
+    return transport
+
+def _evict(ip: str, port: int):
+    transport = _TRANSPORTS.pop((ip, port), None)
+    if transport:
+        try:
+            transport.close()
+        except Exception:
+            pass
+
+def _close_all_transports():
+    for ip, port in list(_TRANSPORTS):
+        _evict(ip, port)
+
+atexit.register(_close_all_transports)
+
 # ==========================================================
 # Load key test results
 # ==========================================================
+# Key-test outcomes that exclude a meter from reading
+_FAIL_TAGS = frozenset(("CAL_FAIL", "FAIL", "NO_DATA"))
+
 def load_key_test_results():
     try:
-        with open(os.path.join(config.RESULTS_DIR, "key_test_log.json"), "r") as f:
-            data = json.load(f)
+        data = load_json_cached(os.path.join(config.RESULTS_DIR, "key_test_log.json"))
         failed_meters = {int(m) for m, vals in data.items()
-                         if any(v in ["CAL_FAIL", "FAIL", "NO_DATA"] for v in vals.values())}
+                         if not _FAIL_TAGS.isdisjoint(vals.values())}
         print(f"[INFO] Loaded key test results: {len(failed_meters)} meters failed key test.")
         return failed_meters
     except Exception as e:
@@ -199,10 +252,8 @@ def calculate_errors(res: Dict, applied_inputs: Dict) -> None:
 # Save results
 # ==========================================================
 def save_results(results: List[Dict]):
-    os.makedirs(config.RESULTS_DIR, exist_ok=True)
     out_file = os.path.join(config.RESULTS_DIR, "3WS2.json")
-    with open(out_file, "w") as f:
-        json.dump(results, f, indent=2)
+    write_json(out_file, results)
     print(f"[INFO] Results saved to {out_file}")
 
 # ==========================================================
@@ -211,7 +262,6 @@ def save_results(results: List[Dict]):
 def main(angle: int = 60):
     print(f"[START] Parameter read session (Angle = {angle}°)")
     all_results = []
-    last_ip = None
     failed_key_meters = load_key_test_results()
 
     # Applied inputs per angle
@@ -230,31 +280,31 @@ def main(angle: int = 60):
     else:
         raise ValueError("Unsupported angle. Use 60.")
 
-    # Read all meters
+    # Resolve (ip, local id) once per meter and walk the meters grouped by IP,
+    # so each IP's transport is opened once instead of once per meter
+    meters_by_ip = {}
     for global_meter in range(1, config.METER_COUNT + 1):
-        if global_meter in failed_key_meters:
-            print(f"⚠️  Skipping meter {global_meter} (failed key test)")
-            all_results.append({"global_meter": global_meter, "local_meter": None, "error": "KEY_FAIL"})
-            continue
-
         ip, local_id = get_ip_and_local(global_meter)
-        if ip != last_ip and last_ip is not None:
-            print(f"[INFO] Switching to {ip}, waiting 3 seconds...")
-            time.sleep(3)
-        last_ip = ip
+        meters_by_ip.setdefault(ip, []).append((global_meter, local_id))
 
-        print(f"\n=== Reading global meter {global_meter} (MCW{local_id} via {ip}) ===")
-        transport = get_transport(ip=ip, port=config.PORT)
+    for ip, meters in meters_by_ip.items():
+        transport = _get_or_open(ip, config.PORT)
         try:
-            res = read_meter(transport, local_id, global_meter)
-            calculate_errors(res, applied_inputs)
-            all_results.append(res)
-        finally:
-            try:
-                transport.close()
-            except Exception:
-                pass
-        time.sleep(0.25)
+            for global_meter, local_id in meters:
+                if global_meter in failed_key_meters:
+                    print(f"⚠️  Skipping meter {global_meter} (failed key test)")
+                    all_results.append({"global_meter": global_meter, "local_meter": None, "error": "KEY_FAIL"})
+                    continue
+
+                print(f"\n=== Reading global meter {global_meter} (MCW{local_id} via {ip}) ===")
+                res = read_meter(transport, local_id, global_meter)
+                calculate_errors(res, applied_inputs)
+                all_results.append(res)
+                time.sleep(0.25)
+        except Exception:
+            # drop the broken connection so the next use reconnects
+            _evict(ip, config.PORT)
+            raise
 
     # Save results once at the end
     save_results(all_results)
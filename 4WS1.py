@@ -8,54 +8,24 @@ Read Parameters Script (Full & Reliable)
     * 1–10  → 192.168.100.100
     * 11–20 → 192.168.100.101
 - Always sends MCW1..10 (never MCW11+).
-- Waits 3 seconds after switching IP/port.
-- Decodes full 9-float frame per read (voltage, current, watt, etc.).
+- Opens one connection per IP and reuses it for all of that IP's meters.
+- Reads the two IP groups in parallel (meters behind one IP stay sequential).
+- Reads all 16 parameters in one block request per meter (voltage, current, watt, etc.).
 - Validates and saves results into a single JSON file (rewritten each run).
 """
 
 import os
-import re
-import json
 import time
 import struct
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple
 
 import config
 from transport import get_transport
 from steps import build_modbus_read_cmd
-
-# ==========================================================
-# Decoder helpers
-# ==========================================================
-def split_segments(raw_bytes: bytes) -> List[str]:
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-def extract_meter_and_payload(segment: str) -> Tuple[int, str]:
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    return (int(m.group(1)), m.group(2)) if m else (None, None)
-
-def decode_escapes(payload: str) -> bytes:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        out.append(ord(payload[i]))
-        i += 1
-    return bytes(out)
+from jsonio import write_json, load_json_cached
+from mcw_parse import split_segments, extract_meter_and_payload, decode_escapes, response_complete
 
 # ==========================================================
 # Parameter map
@@ -69,19 +39,44 @@ PARAM_REGS = [
     ("frequency",  0x0046),
 ]
 
+# One contiguous block covering every register above (2 registers per float)
+BLOCK_START = 0x0000
+BLOCK_COUNT = max(addr for _, addr in PARAM_REGS) + 2 - BLOCK_START
+
+# Precompiled big-endian float decoder, and each parameter's byte offset in the
+# block frame (after slave + func + byte_count)
+_F32_BE = struct.Struct(">f")
+_F32_BE_FROM = _F32_BE.unpack_from
+_PARAM_OFFSETS = tuple((name, 3 + (addr - BLOCK_START) * 2) for name, addr in PARAM_REGS)
+
 # ==========================================================
 # Validation
 # ==========================================================
+def _limits_for(name: str):
+    """(min, max) allowed for a parameter, or None if it has no range check."""
+    if "voltage" in name:
+        return (220.0, 240.0)
+    if "current" in name:
+        return (4.0, 5.5)
+    if "watt" in name:
+        return (0.0, 1500.0)
+    return None
+
+# Resolved once per parameter, so each read is one lookup + one comparison
+_PARAM_LIMITS = {name: _limits_for(name) for name, _ in PARAM_REGS}
+
 def validate_value(name: str, value: float) -> bool:
     if value is None:
         return False
-    if "voltage" in name and not (220.0 <= value <= 240.0):
-        return False
-    if "current" in name and not (4.0 <= value <= 5.5):
-        return False
-    if "watt" in name and not (0.0 <= value <= 1500.0):
-        return False
-    return True
+    lim = _PARAM_LIMITS[name] if name in _PARAM_LIMITS else _limits_for(name)
+    return lim is None or lim[0] <= value <= lim[1]
+
+# ==========================================================
+# Cached read commands (one frame per (meter, register, count))
+# ==========================================================
+@functools.lru_cache(maxsize=512)
+def read_cmd(local_id: int, reg_addr: int, reg_count: int) -> str:
+    return build_modbus_read_cmd(local_id, 1, start_addr=reg_addr, reg_count=reg_count)
 
 # ==========================================================
 # Read individual parameter
@@ -90,15 +85,14 @@ def read_single_param(transport, local_id: int, param_name: str, reg_addr: int,
     """
     Sends a separate read for a single parameter (float, 2 registers = 4 bytes)
     """
-    cmd = build_modbus_read_cmd(local_id, 1, start_addr=reg_addr, reg_count=2)  # 2 registers = 1 float
+    cmd = read_cmd(local_id, reg_addr, 2)  # 2 registers = 1 float
+    expected = 5 + 2 * 2  # slave + func + byte_count + data + CRC
     for attempt in range(retries):
         transport.send_mcw(cmd)
-        raw = transport.recv_all(timeout=config.SOCKET_TIMEOUT)
+        raw = transport.recv_until(lambda d: response_complete(d, local_id, expected),
+                                   timeout=config.SOCKET_TIMEOUT)
         if raw:
-            segments = split_segments(raw)
-            for seg in segments:
-                if seg.startswith(f"MCW{local_id}"):
-                    continue
+            for seg in split_segments(raw):
                 m_id, payload = extract_meter_and_payload(seg)
                 if m_id != local_id or not payload:
                     continue
@@ -108,25 +102,59 @@ def read_single_param(transport, local_id: int, param_name: str, reg_addr: int,
                 byte_count = frame[2]
                 if byte_count < 4:
                     continue
-                data = frame[3:3+4]
                 try:
-                    val = struct.unpack(">f", data)[0]
+                    val = _F32_BE_FROM(frame, 3)[0]  # float right after the 3-byte header
                     if validate_value(param_name, val):
                         return {"value": val}
                     else:
                         return {"value": val, "warning": "out_of_range"}
                 except Exception as e:
                     return {"value": None, "error": str(e)}
-        time.sleep(0.2)
     return {"value": None, "error": "no_response"}
 
 # ==========================================================
-# Read all parameters individually
+# Read all parameters in one block
 # ==========================================================
+def read_meter_block(transport, local_id: int, retries: int = 3):
+    """
+    Reads BLOCK_COUNT registers starting at BLOCK_START in a single transaction.
+    Returns the decoded frame, or None if no complete frame arrived.
+    """
+    cmd = read_cmd(local_id, BLOCK_START, BLOCK_COUNT)
+    data_len = BLOCK_COUNT * 2
+    expected = 5 + data_len
+    for attempt in range(retries):
+        transport.send_mcw(cmd)
+        raw = transport.recv_until(lambda d: response_complete(d, local_id, expected),
+                                   timeout=config.SOCKET_TIMEOUT)
+        if raw:
+            for seg in split_segments(raw):
+                m_id, payload = extract_meter_and_payload(seg)
+                if m_id != local_id or not payload:
+                    continue
+                frame = decode_escapes(payload)
+                if len(frame) < 3 + data_len or frame[2] < data_len:
+                    continue
+                return frame
+    return None
+
 def read_meter(transport, local_id: int, global_id: int) -> Dict:
     res = {"global_meter": global_id, "local_meter": local_id, "params": {}}
-    for param_name, reg_addr in PARAM_REGS:
-        res["params"][param_name] = read_single_param(transport, local_id, param_name, reg_addr)
+    frame = read_meter_block(transport, local_id)
+    if frame is None:
+        # Fall back to one transaction per parameter
+        print(f"[WARN] Block read failed for MCW{local_id}, reading parameters individually")
+        for param_name, reg_addr in PARAM_REGS:
+            res["params"][param_name] = read_single_param(transport, local_id, param_name, reg_addr)
+        return res
+
+    for param_name, offset in _PARAM_OFFSETS:
+        val = _F32_BE_FROM(frame, offset)[0]
+        lim = _PARAM_LIMITS[param_name]
+        if lim is None or lim[0] <= val <= lim[1]:
+            res["params"][param_name] = {"value": val}
+        else:
+            res["params"][param_name] = {"value": val, "warning": "out_of_range"}
     return res
 
 # ==========================================================
@@ -140,12 +168,14 @@ def get_ip_and_local(global_meter: int):
 # ==========================================================
 # Load key test results
 # ==========================================================
+# Key-test outcomes that exclude a meter from reading
+_FAIL_TAGS = frozenset(("CAL_FAIL", "FAIL", "NO_DATA"))
+
 def load_key_test_results():
     try:
-        with open(os.path.join(config.RESULTS_DIR, "key_test_log.json"), "r") as f:
-            data = json.load(f)
+        data = load_json_cached(os.path.join(config.RESULTS_DIR, "key_test_log.json"))
         failed_meters = {int(m) for m, vals in data.items()
-                         if any(v in ["CAL_FAIL", "FAIL", "NO_DATA"] for v in vals.values())}
+                         if not _FAIL_TAGS.isdisjoint(vals.values())}
         print(f"[INFO] Loaded key test results: {len(failed_meters)} meters failed key test.")
         return failed_meters
     except Exception as e:
@@ -155,62 +185,100 @@ def load_key_test_results():
 # ==========================================================
 # Calculate % error and pass/fail (with absolute limits for watt & var)
 # ==========================================================
-def calculate_errors(res: Dict, applied_inputs: Dict) -> None:
+# Pass/fail rule per parameter base name (text before the first "_"):
+#   ("abs", lo, hi, None) -> reading must lie in [lo, hi]
+#   ("pct", None, None, tol) -> |%error| <= tol
+LIMITS = {
+    "watt":      ("abs", 1141, 1159, None),  # absolute limit for watt
+    "var":       ("abs", -5, 5, None),  # absolute limit for var
+    "pf":        ("abs", 0.992, 1.008, None),  # absolute limit for pf
+    "voltage":   ("pct", None, None, 1.0),
+    "current":   ("pct", None, None, 1.0),
+    "frequency": ("pct", None, None, 0.2),
+}
+
+def calculate_errors_all(results: List[Dict], applied_inputs: Dict) -> None:
     """
-    Adds % error and pass/fail for each parameter in res
-    applied_inputs: dict with keys matching PARAM_REGS
+    Adds % error and pass/fail for every parameter of every meter result.
+    Runs column by column after all reads: each parameter's rule and applied input
+    are resolved once, then applied to that parameter on all meters.
     """
-    for param, vals in res["params"].items():
-        reading = vals.get("value")
+    rows = [res["params"] for res in results if "params" in res]
+    for param, _ in PARAM_REGS:
+        rule = LIMITS.get(param.split("_", 1)[0])
         applied = applied_inputs.get(param)
+        for params in rows:
+            vals = params.get(param)
+            if vals is None:
+                continue
+            reading = vals.get("value")
 
-        if reading is None or applied is None:
-            vals["%error"] = None
-            vals["pass_fail"] = "N/A"
-            continue
+            if reading is None or applied is None or rule is None:
+                vals["%error"] = None
+                vals["pass_fail"] = "N/A"
+            else:
+                mode, lo, hi, tol = rule
+                if mode == "abs":
+                    vals["%error"] = None
+                    vals["pass_fail"] = "PASS" if lo <= reading <= hi else "FAIL"
+                else:
+                    error = 100 * (reading - applied) / applied
+                    vals["%error"] = error
+                    vals["pass_fail"] = "PASS" if abs(error) <= tol else "FAIL"
 
-        # Determine pass/fail limits
-        if param.startswith("watt"):
-            limit_min, limit_max = 1141, 1159  # absolute limit for watt
-            vals["%error"] = None
-            vals["pass_fail"] = "PASS" if limit_min <= reading <= limit_max else "FAIL"
-        elif param.startswith("var"):
-            limit_min, limit_max = -5, 5  # absolute limit for var
-            vals["%error"] = None
-            vals["pass_fail"] = "PASS" if limit_min <= reading <= limit_max else "FAIL"
-        elif param.startswith("voltage") or param.startswith("current"):
-            error = 100 * (reading - applied) / applied
-            vals["%error"] = error
-            vals["pass_fail"] = "PASS" if abs(error) <= 1.0 else "FAIL"
-        elif param.startswith("frequency"):
-            error = 100 * (reading - applied) / applied
-            vals["%error"] = error
-            vals["pass_fail"] = "PASS" if abs(error) <= 0.2 else "FAIL"
-        elif param.startswith("pf"):
-            limit_min, limit_max = 0.992, 1.008  # absolute limit for pf
-            vals["%error"] = None
-            vals["pass_fail"] = "PASS" if limit_min <= reading <= limit_max else "FAIL"
-        else:
-            vals["%error"] = None
-            vals["pass_fail"] = "N/A"
+def calculate_errors(res: Dict, applied_inputs: Dict) -> None:
+    """
+    Adds % error and pass/fail for each parameter in res
+    applied_inputs: dict with keys matching PARAM_REGS
+    """
+    calculate_errors_all([res], applied_inputs)
 
 # ==========================================================
 # Save results
 # ==========================================================
 def save_results(results: List[Dict]):
-    os.makedirs(config.RESULTS_DIR, exist_ok=True)
     out_file = os.path.join(config.RESULTS_DIR, "4WS1.json")
-    with open(out_file, "w") as f:
-        json.dump(results, f, indent=2)
+    write_json(out_file, results)
     print(f"[INFO] Results saved to {out_file}")
 
+# ==========================================================
+# Read every meter behind one IP (one worker per IP)
+# ==========================================================
+def read_ip_group(ip: str, meters: List[Tuple[int, int]], failed_key_meters) -> List[Dict]:
+    """
+    Reads meters [(global_id, local_id), ...] one after another over a single
+    connection to ip. The device serializes requests, so only IPs run in parallel.
+    """
+    results = []
+    transport = None
+    try:
+        for global_meter, local_id in meters:
+            if global_meter in failed_key_meters:
+                print(f"⚠️  Skipping meter {global_meter} (failed key test)")
+                results.append({"global_meter": global_meter, "local_meter": None, "error": "KEY_FAIL"})
+                continue
+
+            if transport is None:
+                print(f"[INFO] Connecting to {ip}")
+                transport = get_transport(ip=ip, port=config.PORT)
+
+            print(f"\n=== Reading global meter {global_meter} (MCW{local_id} via {ip}) ===")
+            results.append(read_meter(transport, local_id, global_meter))
+            time.sleep(0.25)
+    finally:
+        if transport:
+            try:
+                transport.close()
+            except Exception:
+                pass
+    return results
+
 # ==========================================================
 # Main
 # ==========================================================
 def main(angle: int = 0):
     print(f"[START] Parameter read session (Angle = {angle}°)")
     all_results = []
-    last_ip = None
     failed_key_meters = load_key_test_results()
 
     # Applied inputs per angle
@@ -235,30 +303,19 @@ def main(angle: int = 0):
     else:
         raise ValueError("Unsupported angle. Use 0 or 60.")
 
+    meters_by_ip = {}
     for global_meter in range(1, config.METER_COUNT + 1):
-        if global_meter in failed_key_meters:
-            print(f"⚠️  Skipping meter {global_meter} (failed key test)")
-            all_results.append({"global_meter": global_meter, "local_meter": None, "error": "KEY_FAIL"})
-            continue
-
         ip, local_id = get_ip_and_local(global_meter)
-        if ip != last_ip and last_ip is not None:
-            print(f"[INFO] Switching to {ip}, waiting 3 seconds...")
-            time.sleep(3)
-        last_ip = ip
+        meters_by_ip.setdefault(ip, []).append((global_meter, local_id))
 
-        print(f"\n=== Reading global meter {global_meter} (MCW{local_id} via {ip}) ===")
-        transport = get_transport(ip=ip, port=config.PORT)
-        try:
-            res = read_meter(transport, local_id, global_meter)
-            calculate_errors(res, applied_inputs)  # Add pass/fail logic
-            all_results.append(res)
-        finally:
-            try:
-                transport.close()
-            except Exception:
-                pass
-        time.sleep(0.25)
+    # Each IP is an independent gateway, so read the groups side by side
+    with ThreadPoolExecutor(max_workers=max(1, len(meters_by_ip))) as ex:
+        futures = [ex.submit(read_ip_group, ip, meters, failed_key_meters)
+                   for ip, meters in meters_by_ip.items()]
+        for f in futures:
+            all_results.extend(f.result())
+    all_results.sort(key=lambda r: r["global_meter"])
+    calculate_errors_all(all_results, applied_inputs)  # Add pass/fail logic
 
     save_results(all_results)
     print(f"[END] Parameter read session completed (Angle = {angle}°)")
@@ -6,6 +6,12 @@ IP = ("192.168.100.101"
       "")
 PORT = 12345
 
+# Pacing: wait for each reply (up to REPLY_TIMEOUT), then keep a short quiet gap.
+# The gap is cut to what is left of REPLY_TIMEOUT, so one command never takes longer
+# than the old fixed delay, even when the device stays silent.
+REPLY_TIMEOUT = 0.1  # previous fixed per-command delay
+MIN_GAP = 0.02
+
 # List of commands (without <cr>, will add \r automatically)
 EC_COMMANDS = [
     # "ECRES0,0;CTRES0,0;TIRES0,0;EHRES0;MCRES0",
@@ -106,16 +112,45 @@ EC_COMMANDS = [
     # #"WRSTA#,1",
 ]
 
+def wait_for_reply(sock, cmd, timeout):
+    """
+    Read until the device answers cmd (a CR-terminated line other than its echo)
+    or timeout seconds pass. Returns whatever was received.
+    """
+    echo = cmd.encode("ascii", errors="ignore")
+    deadline = time.time() + timeout
+    data = b""
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        sock.settimeout(remaining)
+        try:
+            chunk = sock.recv(4096)
+        except socket.timeout:
+            break
+        if not chunk:
+            break
+        data += chunk
+        if any(line.strip() and line.strip() != echo for line in data.split(b"\r")[:-1]):
+            break
+    return data
+
 def main():
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect((IP, PORT))
+        # Short ASCII commands: disable Nagle so each one is sent immediately
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print(f"Connected to {IP}:{PORT}")
 
         for cmd in EC_COMMANDS:
             msg = (cmd + "\r").encode("ascii", errors="ignore")
+            sent_at = time.time()
             sock.sendall(msg)
             print(f">> Sent: {cmd}")
-            time.sleep(0.1)  # 300 ms delay
+            wait_for_reply(sock, cmd, REPLY_TIMEOUT)
+            left = REPLY_TIMEOUT - (time.time() - sent_at)
+            time.sleep(max(0.0, min(MIN_GAP, left)))
 
         print("✅ All commands sent.")
 
@@ -6,6 +6,13 @@ import config
 IPS = ["192.168.100.100", "192.168.100.101"]
 PORT = 12345
 
+# Pacing: one write at a time. Wait for its reply (up to REPLY_TIMEOUT), and never
+# start the next EEPROM write less than MIN_GAP after the previous one was sent -
+# these are MCW0 broadcasts, so an early line from one meter does not mean all have
+# finished writing.
+REPLY_TIMEOUT = 3.0  # previous fixed per-command delay
+MIN_GAP = getattr(config, "EPROM_MIN_GAP", 1.0)
+
 # List of commands (without <cr>, will add \r automatically)
 COMMANDS = [
     "MCW0,^h01^h10^h25^h80^h00^h02^h04^h44^hFC^hE0^h00^hC0^h5E",
@@ -13,16 +20,44 @@ COMMANDS = [
     "MCW0,^h01^h10^h17^hD4^h00^h02^h04^h47^hF1^h20^h00^h48^h77"
 ]
 
+def wait_for_reply(sock, cmd, timeout):
+    """
+    Read until the device answers cmd (a CR-terminated line other than its echo)
+    or timeout seconds pass. Returns whatever was received.
+    """
+    echo = cmd.encode("ascii", errors="ignore")
+    deadline = time.time() + timeout
+    data = b""
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        sock.settimeout(remaining)
+        try:
+            chunk = sock.recv(4096)
+        except socket.timeout:
+            break
+        if not chunk:
+            break
+        data += chunk
+        if any(line.strip() and line.strip() != echo for line in data.split(b"\r")[:-1]):
+            break
+    return data
+
 def send_commands(ip):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect((ip, PORT))
+        # Short ASCII commands: disable Nagle so each one is sent immediately
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print(f"Connected to {ip}:{PORT}")
 
         for cmd in COMMANDS:
             msg = (cmd + "\r").encode("ascii", errors="ignore")
+            sent_at = time.time()
             sock.sendall(msg)
             print(f">> Sent: {cmd}")
-            time.sleep(3)  # 3 s delay
+            wait_for_reply(sock, cmd, REPLY_TIMEOUT)
+            time.sleep(max(0.0, MIN_GAP - (time.time() - sent_at)))
 
         print(f"✅ All commands sent to {ip}.\n")
 
@@ -9,66 +9,23 @@ the parameter summary JSON files (meter_params, 4WS*, 3WS*).
 
 import os
 import time
-import json
 import struct
-import re
 from typing import Dict, Set
 
 import config
 from transport import get_transport
 import steps
+from mcw_parse import split_segments, extract_meter_and_payload, decode_escapes
+from jsonio import write_json, load_json_cached
 
 
 # ---------------- Helper functions ----------------
 
-def split_segments(raw_bytes: bytes):
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-
-def extract_meter_and_payload(segment: str):
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    return (int(m.group(1)), m.group(2)) if m else (None, None)
-
-
-def decode_escapes(payload: str) -> bytes:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == '^':
-            if payload[i:i+2] == '^h' and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            if i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        elif payload[i] == '<':
-            m = re.match(r"<(\d{3})>", payload[i:])
-            if m:
-                v = int(m.group(1))
-                if 128 <= v <= 255:
-                    out.append(v)
-                    i += len(m.group(0))
-                    continue
-        out.append(ord(payload[i]))
-        i += 1
-    return bytes(out)
-
-
 def parse_meter_response(raw: bytes, local_id: int, global_id: int) -> Dict:
     res = {"global_meter": global_id, "local_meter": local_id, "params": {}}
     segments = split_segments(raw)
 
     for seg in segments:
-        if seg.startswith(f"MCW{local_id}"):
-            continue
         m_id, payload = extract_meter_and_payload(seg)
         if m_id != local_id or not payload:
             continue
@@ -107,8 +64,7 @@ def load_passed_meters() -> Set[int]:
     passed = set(range(1, config.METER_COUNT + 1))
 
     try:
-        with open(os.path.join(config.RESULTS_DIR, 'key_test_log.json')) as f:
-            data = json.load(f)
+        data = load_json_cached(os.path.join(config.RESULTS_DIR, 'key_test_log.json'))
         key_pass = {
             int(m) for m, vals in data.items()
             if all(v == "PASS" for v in vals.values())
@@ -141,8 +97,7 @@ def load_problematic_meters() -> Set[int]:
             continue
 
         try:
-            with open(fpath) as f:
-                data = json.load(f)
+            data = load_json_cached(fpath)
 
             if not isinstance(data, list):
                 continue
@@ -248,10 +203,8 @@ def run_caldone():
 
         time.sleep(0.25)
 
-    os.makedirs(config.RESULTS_DIR, exist_ok=True)
     log_file = os.path.join(config.RESULTS_DIR, 'caldone_log.json')
-    with open(log_file, 'w') as f:
-        json.dump(results, f, indent=2)
+    write_json(log_file, results)
 
     print_summary_table(results)
     print(f"✅ Cal Done session complete. Log saved to {log_file}")
@@ -1,11 +1,14 @@
 # calibration.py
 """
-Calibration runner (sequential, with proper decoder)
-----------------------------------------------------
-- Connects to meters sequentially (1..METER_COUNT).
+Calibration runner (pipelined per IP, with proper decoder)
+----------------------------------------------------------
+- Calibrates meters 1..METER_COUNT, grouped by connection.
 - Picks IP based on meter number (1–10 → .100, 11–20 → .101).
 - Always sends MCW1..10 (never MCW11+).
-- After switching IP/port, waits 3 seconds before sending.
+- Keeps one connection per IP/port open for the run; stale bytes are
+  drained before sending instead of waiting a fixed 3 seconds.
+- Pipelines the command to every meter behind an IP in one write and
+  retries only the meters that have not passed.
 - Uses full decoder (split + escape decode) for responses.
 - Compares decoded reply with expected.
 - Saves JSON + TXT logs.
@@ -13,10 +16,11 @@ Calibration runner (sequential, with proper decoder)
 """
 
 import time
-import json
-import re
+import functools
 import config
 from transport import SocketTransport  # your custom socket wrapper
+from jsonio import write_json
+from mcw_parse import split_segments, extract_meter_and_payload, decode_hex, response_complete
 
 
 # ==========================================================
@@ -33,97 +37,54 @@ BASE_COMMANDS = [
 # ==========================================================
 # Decoder helpers
 # ==========================================================
-def split_segments(raw_bytes: bytes):
-    """Split raw MCW ASCII response into segments by CR."""
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-
-def extract_meter_and_payload(segment: str):
-    """
-    Extract meter ID and payload.
-    - Skip echoes like 'MCW1,...'
-    - Real responses: 'F<n>,MCW1,...'
-    """
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),(?:MC\w+)?,(.*)", segment)
-    if m:
-        return int(m.group(1)), m.group(2)
-    return None, None
-
-
-def decode_escapes(payload: str) -> str:
+def parse_batch_response(raw: bytes, mcw_nums) -> dict:
     """
-    Decode escape sequences:
-    - ^hXX → hex byte
-    - ^X   → control char (X & 0x1F)
-    - <NNN> → byte 128–255
-    Returns uppercase hex string.
-    """
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        elif payload[i] == "<":
-            match = re.match(r"<(\d{3})>", payload[i:])
-            if match:
-                val = int(match.group(1))
-                if 128 <= val <= 255:
-                    out.append(val)
-                    i += len(match.group(0))
-                    continue
-        out.append(ord(payload[i]))
-        i += 1
-    return out.hex().upper()
-
-
-def parse_response(raw: bytes, mcw_num: int):
-    """
-    Parse response for a single MCW<n> command.
+    Parse a response holding replies for one or more MCW<n> commands.
     Debug prints raw data, segments, and decoded payloads.
+    Returns {mcw_num: decoded hex} with the first reply of each requested MCW<n>.
     """
+    decoded_by_mcw = {}
     if not raw:
         print(" ⚠ No raw data received.")
-        return ""
+        return decoded_by_mcw
 
-    # Print raw bytes as hex
-    print(" Raw bytes:", " ".join(f"{b:02X}" for b in raw))
+    # Print raw bytes as hex (one C-level bytes.hex call)
+    print(" Raw bytes:", raw.hex(" ").upper())
 
-    # Split into ASCII segments
+    # Split into segments (bytes); each is decoded to text once, for display only
     segments = split_segments(raw)
-    print(" Segments:", segments)
+    texts = [seg.decode("latin1") for seg in segments]
+    print(" Segments:", texts)
 
     # Try extracting + decoding each segment
-    for seg in segments:
+    for seg, text in zip(segments, texts):
         meter_id, payload = extract_meter_and_payload(seg)
-        print(f"  → Segment: '{seg}' | MeterID={meter_id}, Payload={payload}")
+        print(f"  → Segment: '{text}' | MeterID={meter_id}, "
+              f"Payload={payload.decode('latin1') if payload else payload}")
         if not meter_id or not payload:
             continue
 
-        decoded = decode_escapes(payload)
+        decoded = decode_hex(payload)
         print(f"    Decoded payload (hex): {decoded}")
 
-        if meter_id == mcw_num:  # Only return for the matching MCW<n>
-            return decoded
+        if meter_id in mcw_nums and meter_id not in decoded_by_mcw:
+            decoded_by_mcw[meter_id] = decoded
 
-    return ""  # No matching segment found
+    return decoded_by_mcw
+
+
+def parse_response(raw: bytes, mcw_num: int):
+    """
+    Parse response for a single MCW<n> command.
+    Returns the decoded hex reply, or "" if no matching segment was found.
+    """
+    return parse_batch_response(raw, (mcw_num,)).get(mcw_num, "")
 
 
 # ==========================================================
 # Helper: Pick IP based on meter ID
 # ==========================================================
+@functools.lru_cache(maxsize=None)  # pure function of meter_id for a run
 def get_ip_for_meter(meter_id: int):
     if meter_id <= 10:
         return config.METER_CONNECTIONS[0]
@@ -136,114 +97,155 @@ def get_ip_for_meter(meter_id: int):
 # ==========================================================
 def save_run_log(summary):
     try:
-        with open(config.RUN_JSON, "w") as jf:
-            json.dump(summary, jf, indent=2)
+        write_json(config.RUN_JSON, summary)
         with open(config.RUN_LOG, "w") as tf:
-            for entry in summary.get("meters", []):
-                tf.write(
-                    f"{entry['name']}: {entry['status']} | Response: {entry['received']}\n"
-                )
+            tf.write("".join(
+                f"{entry['name']}: {entry['status']} | Response: {entry['received']}\n"
+                for entry in summary.get("meters", [])
+            ))
     except Exception as e:
         print(f"⚠ Failed to save logs: {e}")
 
 
-def print_results_table(meter_results):
+def print_results_table(meter_ids, statuses, receiveds):
     """
     Print calibration results in SQL-like table.
     Columns: Meter | Status | Response
+    Takes the per-meter columns (same order) rather than a list of dicts.
     """
     print("\n+-------+--------+------------------+")
     print("| Meter | Status |     Response     |")
     print("+-------+--------+------------------+")
-    for entry in meter_results:
-        meter = entry["name"].replace("meter ", "")
-        status = entry["status"]
-        response = entry["received"] if entry["received"] else "N/A"
+    for meter, status, received in zip(meter_ids, statuses, receiveds):
+        response = received if received else "N/A"
         print("| {:<5} | {:<6} | {:<16} |".format(meter, status, response))
     print("+-------+--------+------------------+\n")
 
 
+# ==========================================================
+# Pipelined calibration of all meters behind one connection
+# ==========================================================
+POLL_GAP = getattr(config, "POLL_GAP", 0.01)
+CAL_REPLY_LEN = 8  # write-multiple reply: slave + func + addr + count + CRC
+
+
+def calibrate_batch(transport, meter_ids, cmd_of, expected_resp, max_retries):
+    """
+    Each attempt sends the command for every meter that has not passed yet in one
+    write, then reads until all of them have replied (or timeout). Replies are
+    routed back to meters by their F<n> id. cmd_of maps meter_id -> prebuilt command;
+    expected_resp should be a set (membership test per reply).
+    Returns {meter_id: (status, received)}.
+    """
+    mcw_of = {meter_id: (meter_id - 1) % 10 + 1 for meter_id in meter_ids}
+    outcome = {meter_id: ("COMM_ERROR", None) for meter_id in meter_ids}
+    pending = list(meter_ids)
+
+    for attempt in range(1, max_retries + 1):
+        if not pending:
+            break
+        print(f" Attempt {attempt} of {max_retries} for meters {pending}")
+        cmds = [cmd_of[meter_id] for meter_id in pending]
+        for cmd in cmds:
+            print(f"Sending calibration command: {cmd}")
+        transport.send_mcw_batch(cmds)
+
+        waiting = [mcw_of[meter_id] for meter_id in pending]
+        # The meters on this channel answer one after another, so allow one reply time each
+        raw = transport.recv_until(
+            lambda data: all(response_complete(data, n, CAL_REPLY_LEN) for n in waiting),
+            timeout=config.SOCKET_TIMEOUT * len(waiting),
+        )
+        if not raw:
+            print(" ❌ No response received.")
+        decoded_by_mcw = parse_batch_response(raw, waiting)
+
+        still_pending = []
+        for meter_id in pending:
+            decoded = decoded_by_mcw.get(mcw_of[meter_id])
+            if decoded:
+                print(f" Meter {meter_id} decoded response: {decoded}")
+                outcome[meter_id] = ("PASS" if decoded in expected_resp else "FAIL", decoded)
+            if outcome[meter_id][0] != "PASS":
+                still_pending.append(meter_id)
+        pending = still_pending
+
+        if pending:
+            time.sleep(POLL_GAP)  # small gap before retrying; reads themselves are reply-driven
+
+    return outcome
+
+
 # ==========================================================
 # Main Calibration Routine
 # ==========================================================
 def run_calibration():
-    passed, failed, skipped = [], [], []
-    meter_results = []
+    # Results are kept as parallel columns, one entry per meter in run order
+    ids, statuses, receiveds, commands, ips = [], [], [], [], []
     max_meters = config.METER_COUNT
     MAX_RETRIES = 3
-    last_connection = None
+    cmd_template, expected_resp = BASE_COMMANDS[0]
+    expected_resp = frozenset(expected_resp)  # O(1) reply check
 
     print("\n--- Calibration: Executing Commands ---")
 
+    # Meters behind the same IP/port share one connection and one pipelined batch
+    # MCW number and command per meter, computed once (index by meter_id - 1)
+    mcw_nums = [(m - 1) % 10 + 1 for m in range(1, max_meters + 1)]
+    meter_cmds = [cmd_template.format(m=n) for n in mcw_nums]
+
+    groups = {}
     for meter_id in range(1, max_meters + 1):
-        mcw_num = (meter_id - 1) % 10 + 1
-        cmd_template, expected_resp = BASE_COMMANDS[0]
-        cmd = cmd_template.format(m=mcw_num)
-        ip, port = get_ip_for_meter(meter_id)
-
-        print(f"\nMeter {meter_id} @ {ip}:{port}")
-        transport = SocketTransport(ip=ip, port=port, timeout=config.SOCKET_TIMEOUT)
-
-        if last_connection != (ip, port):
-            print(" ⏳ New connection detected, waiting 3 seconds...")
-            time.sleep(3)
-            last_connection = (ip, port)
-
-        print(f"Sending calibration command: {cmd}")
-        status = "COMM_ERROR"
-        received = None
-
-        for attempt in range(1, MAX_RETRIES + 1):
-            print(f" Attempt {attempt} of {MAX_RETRIES}")
-            transport.send_mcw(cmd)
-            raw = transport.recv_all(timeout=config.SOCKET_TIMEOUT)
-            if not raw:
-                print(" ❌ No response received.")
-            else:
-                decoded = parse_response(raw, mcw_num)
-                print(f" Decoded response: {decoded}")
-
-                if decoded:
-                    received = decoded
-                    if decoded in expected_resp:
-                        status = "PASS"
-                        time.sleep(0.3)  # short settle before break
-                        break
-                    else:
-                        status = "FAIL"
-                else:
-                    status = "COMM_ERROR"
-
-            time.sleep(0.3)
-
-        if status == "PASS":
-            passed.append(meter_id)
-        elif status == "FAIL":
-            failed.append(meter_id)
-        else:
-            skipped.append(meter_id)
-
-        print(f"Meter {meter_id}: {status} | Received: {received}")
-        meter_results.append({
-            "name": f"meter {meter_id}",
-            "status": status,
-            "received": received,
-            "command": cmd,
-            "ip": ip,
-        })
-        transport.close()
+        groups.setdefault(get_ip_for_meter(meter_id), []).append(meter_id)
+
+    # One long-lived connection per IP, opened up front and closed once at the end
+    conns = {(ip, port): SocketTransport(ip=ip, port=port, timeout=config.SOCKET_TIMEOUT)
+             for (ip, port) in groups}
 
+    try:
+        for (ip, port), meter_ids in groups.items():
+            print(f"\nMeters {meter_ids[0]}-{meter_ids[-1]} @ {ip}:{port}")
+            transport = conns[(ip, port)]
+            # Short drain instead of a fixed 3 s wait: connects and discards any stale bytes
+            try:
+                transport.recv_all(timeout=0.05)
+            except OSError as e:
+                print(f"[WARN] Drain on {ip}:{port} failed: {e}")
+
+            cmd_of = {meter_id: meter_cmds[meter_id - 1] for meter_id in meter_ids}
+            outcome = calibrate_batch(transport, meter_ids, cmd_of, expected_resp, MAX_RETRIES)
+
+            for meter_id in meter_ids:
+                status, received = outcome[meter_id]
+                print(f"Meter {meter_id}: {status} | Received: {received}")
+                ids.append(meter_id)
+                statuses.append(status)
+                receiveds.append(received)
+                commands.append(meter_cmds[meter_id - 1])
+                ips.append(ip)
+    finally:
+        for transport in conns.values():
+            transport.close()
+
+    passed = [m for m, s in zip(ids, statuses) if s == "PASS"]
+    failed = [m for m, s in zip(ids, statuses) if s == "FAIL"]
+    skipped = [m for m, s in zip(ids, statuses) if s not in ("PASS", "FAIL")]
+
+    # run_results.json keeps its per-meter record layout for anything reading it
     summary = {
         "run_time": time.ctime(),
-        "meters": meter_results,
-        "passed": sorted(set(passed)),
-        "failed": sorted(set(failed)),
-        "skipped": sorted(set(skipped)),
+        "meters": [
+            {"name": f"meter {m}", "status": s, "received": r, "command": c, "ip": i}
+            for m, s, r, c, i in zip(ids, statuses, receiveds, commands, ips)
+        ],
+        "passed": sorted(passed),
+        "failed": sorted(failed),
+        "skipped": sorted(skipped),
     }
     save_run_log(summary)
 
     # ✅ Print SQL-like table
-    print_results_table(meter_results)
+    print_results_table(ids, statuses, receiveds)
 
     return passed, failed, skipped
 
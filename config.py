@@ -5,18 +5,40 @@
 
 import os
 import time
+import logging
 import socket
-import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor, wait
 from tkinter import simpledialog, messagebox
+from ui_root import get_root
 
 # ============================================================
 # HARDWARE INITIALIZATION (auto-run on import)
 # ============================================================
 
+def _init_one(host, port, commands):
+    """Connect to one gateway and send all init commands in a single CR-framed burst."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.settimeout(3)
+            s.connect((host, port))
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if hasattr(socket, "TCP_QUICKACK"):  # Linux only
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            # The device splits on CR, so one write keeps per-command framing
+            s.sendall(b"".join((cmd + '\r').encode('ascii') for cmd in commands))
+            # One print per host so the parallel workers don't interleave lines
+            print("\n".join(f"➡️ Sent to {host}: {cmd}" for cmd in commands))
+            time.sleep(0.05)
+            print(f"✅ Initialization done for {host}:{port}\n")
+    except Exception as e:
+        print(f"⚠️ Could not initialize {host}:{port} -> {e}")
+
+
 def initialize_hardware():
     """
     Sends basic initialization commands to all configured meter IPs.
     Runs automatically when this config is imported.
+    The gateways are independent, so they are initialized in parallel.
     """
     commands = [
         'VER',
@@ -36,56 +58,80 @@ def initialize_hardware():
     print("🔧 Initializing hardware...")
     print("============================")
 
-    for host, port in targets:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(3)
-                s.connect((host, port))
-                for cmd in commands:
-                    s.sendall((cmd + '\r').encode('ascii'))
-                    print(f"➡️ Sent to {host}: {cmd}")
-                    time.sleep(0.05)
-                print(f"✅ Initialization done for {host}:{port}\n")
-        except Exception as e:
-            print(f"⚠️ Could not initialize {host}:{port} -> {e}")
+    with ThreadPoolExecutor(max_workers=max(1, len(targets))) as ex:
+        futures = [ex.submit(_init_one, host, port, commands) for host, port in targets]
+        wait(futures)
 
     print("✅ Hardware initialization complete.\n")
     time.sleep(0.5)
 
 
 # ============================================================
-# SINGLE-RUN PROTECTION (avoid re-running on re-import)
+# USER INPUT — METER COUNT PROMPT
 # ============================================================
 
-if not globals().get("_HARDWARE_INIT_DONE", False):
-    initialize_hardware()
-    globals()["_HARDWARE_INIT_DONE"] = True
+def ask_meter_count() -> int:
+    """Ask the operator for the number of connected meters (1–20) until a value is given."""
+    root = get_root()  # shared hidden root, reused by later dialogs
+    while True:
+        try:
+            value = simpledialog.askinteger(
+                "Meter Setup",
+                "Enter number of meters connected (1–20):",
+                minvalue=1,
+                maxvalue=20,
+                parent=root,
+            )
+            if value is None:
+                messagebox.showerror("Error", "You must enter a value to continue.", parent=root)
+            else:
+                return value
+        except Exception as e:
+            messagebox.showerror("Error", f"Invalid input: {e}", parent=root)
+
+
+def _meter_count_from_env():
+    """METER_COUNT environment variable (1–20), or None if unset/invalid."""
+    raw = os.environ.get("METER_COUNT", "").strip()
+    if not raw:
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        value = 0
+    if 1 <= value <= 20:
+        return value
+    print(f"⚠️ Ignoring METER_COUNT={raw!r} (expected 1–20)")
+    return None
 
 
 # ============================================================
-# USER INPUT — METER COUNT PROMPT
+# BOOTSTRAP (single-run protection: avoid re-running on re-import)
 # ============================================================
 
-root = tk.Tk()
-root.withdraw()
-
+_HARDWARE_INIT_DONE = False
 METER_COUNT = None
-while METER_COUNT is None:
-    try:
-        value = simpledialog.askinteger(
-            "Meter Setup",
-            "Enter number of meters connected (1–20):",
-            minvalue=1,
-            maxvalue=20,
-        )
-        if value is None:
-            messagebox.showerror("Error", "You must enter a value to continue.")
-        else:
-            METER_COUNT = value
-    except Exception as e:
-        messagebox.showerror("Error", f"Invalid input: {e}")
-root.destroy()
-print(f"✅ Meter count set to {METER_COUNT}")
+
+
+def bootstrap() -> int:
+    """
+    Hardware initialization + meter count, done once per process.
+    - CAL_SKIP_HW_INIT=1 skips the gateway init (headless / no hardware).
+    - METER_COUNT=<1..20> skips the Tk prompt, so no display is needed.
+    Returns METER_COUNT.
+    """
+    global _HARDWARE_INIT_DONE, METER_COUNT
+    if not _HARDWARE_INIT_DONE:
+        if os.environ.get("CAL_SKIP_HW_INIT") != "1":
+            initialize_hardware()
+        _HARDWARE_INIT_DONE = True
+    if METER_COUNT is None:
+        METER_COUNT = _meter_count_from_env() or ask_meter_count()
+        print(f"✅ Meter count set to {METER_COUNT}")
+    return METER_COUNT
+
+
+bootstrap()
 
 # ============================================================
 # GENERAL SETTINGS
@@ -103,6 +149,7 @@ PORT = 12345
 SOCKET_PORT = PORT
 SOCKET_TIMEOUT = 2.0
 COMMAND_GAP = 0.1
+POLL_GAP = 0.01          # gap between reply-driven polls (key test, calibration)
 READ_LOOP_TIMEOUT = 1.0
 
 # ============================================================
@@ -119,6 +166,14 @@ RUN_LOG = os.path.join(RESULTS_DIR, "run_log.txt")
 
 ALLOW_OPERATOR_PROMPTS = True
 
+# Root logger at INFO: decoder debug dumps are skipped unless this is set to DEBUG.
+# Any case is accepted; an unknown name falls back to INFO instead of failing the import
+LOG_LEVEL = (os.environ.get("CAL_LOG_LEVEL") or "INFO").strip().upper()
+if not isinstance(logging.getLevelName(LOG_LEVEL), int):
+    print(f"[WARN] Unknown CAL_LOG_LEVEL {LOG_LEVEL!r}, using INFO")
+    LOG_LEVEL = "INFO"
+logging.basicConfig(level=LOG_LEVEL, format="%(levelname)s %(name)s: %(message)s")
+
 # ============================================================
 # EXPECTED RESPONSES
 # ============================================================
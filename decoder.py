@@ -5,33 +5,49 @@
 #   - 5E escape sequence decoding
 #   - Splitting a byte stream using CR (carriage return)
 #   - Assigning data segments to meters using byte markers
+# Intermediate results are logged at DEBUG level (logger 'decoder').
+
+import functools
+import logging
 
 import config
 
+# Debug dumps go through logging so they cost nothing unless DEBUG is enabled
+log = logging.getLogger(__name__)
+
 
 # ------------------------------------
 # 5E Escape Sequence Decoding Function
 # ------------------------------------
 
+def _decode_5e(buf: bytes) -> bytes:
+    """
+    Decodes 5E escape sequences in a raw byte buffer (5E xx -> xx - 0x40, floored at 0).
+    Buffers without any 0x5E are returned as-is without copying.
+    """
+    j = buf.find(0x5E)
+    if j == -1:
+        return buf
+    out = bytearray()
+    i, n = 0, len(buf)
+    # Copy the runs between escapes in one slice each; only the 5E pairs are touched
+    while j != -1 and j + 1 < n:
+        out += buf[i:j]
+        out.append(max(buf[j + 1] - 0x40, 0))
+        i = j + 2
+        j = buf.find(0x5E, i)
+    out += buf[i:]
+    return bytes(out)
+
+
 def process_hex_data(data_str: str) -> str:
     """
     Decodes a contiguous hex string containing 5E escape sequences.
     Returns a continuous hex string (no spaces).
     """
-    s = data_str.upper()
-    hex_pairs = [s[i:i + 2] for i in range(0, len(s), 2)]
-    result = []
-    i = 0
-    while i < len(hex_pairs):
-        if hex_pairs[i] == '5E' and i + 1 < len(hex_pairs):
-            val = int(hex_pairs[i + 1], 16) - 0x40
-            result.append(f"{max(val, 0):02X}")
-            i += 2
-        else:
-            result.append(hex_pairs[i])
-            i += 1
-    print(''.join(result))
-    return ''.join(result)   # continuous string
+    result = _decode_5e(bytes.fromhex(data_str)).hex().upper()
+    log.debug("%r", result)
+    return result   # continuous string
 
 
 # ------------------------------------
@@ -48,25 +64,20 @@ def split_segments_by_CR(raw_bytes: bytes) -> list[str]:
     Returns:
         list[str]: List of hex string segments separated by CR.
     """
-    segments = []
-    buf = raw_bytes
-    while True:
-        idx = buf.find(b'\x0D')
-        if idx == -1:
-            break
-        segment = buf[:idx]
-        buf = buf[idx + 1:]
-        if segment:
-            hex_str = ''.join(f"{b:02X}" for b in segment)
-            segments.append(hex_str)
-    print(segments)
-    return segments
+    # Bytes after the last CR are an incomplete segment and are dropped
+    return [seg.hex().upper() for seg in raw_bytes.split(b'\x0D')[:-1] if seg]
 
 
 # ------------------------------------
 # Assign Hex Segments to Meter Channels
 # ------------------------------------
 
+@functools.lru_cache(maxsize=8)
+def _valid_markers(meter_count: int) -> frozenset:
+    """Second-byte markers '31'.. for meters 1..meter_count (cached per METER_COUNT)."""
+    return frozenset(f"{x:02X}" for x in range(0x31, 0x31 + meter_count))
+
+
 def process_by_second_marker(segments: list[str]) -> tuple[dict, list]:
     """
     Assigns each hex segment to its meter, using the marker in the second byte.
@@ -84,10 +95,10 @@ def process_by_second_marker(segments: list[str]) -> tuple[dict, list]:
     """
     final = {f"meter {i}": [] for i in range(1, config.METER_COUNT + 1)}
     unassigned = []
+    valid_markers = _valid_markers(config.METER_COUNT)
     for seg in segments:
         if len(seg) >= 4:
             marker = seg[2:4]  # 2nd byte (positions 2 and 3)
-            valid_markers = [f"{x:02X}" for x in range(0x31, 0x31 + config.METER_COUNT)]
             if marker in valid_markers:
                 meter_number = int(marker, 16) - 0x30
                 tokens = [seg[i:i + 2] for i in range(4, len(seg), 2)]
@@ -101,8 +112,8 @@ def process_by_second_marker(segments: list[str]) -> tuple[dict, list]:
                 unassigned.append(seg)
         else:
             unassigned.append(seg)
-    print(final)
-    print(unassigned)
+    log.debug("%r", final)
+    log.debug("%r", unassigned)
     return final, unassigned
 
 
@@ -127,8 +138,8 @@ def decode_raw_bytes(raw_bytes: bytes) -> tuple[dict, list]:
             - Mapping of meter names to decoded token lists
             - List of segments not mapped to any meter
     """
-    segments = split_segments_by_CR(raw_bytes)
-    decoded_segments = [process_hex_data(seg) for seg in segments]
+    # Decode the raw CR segments directly; hex-encode once per segment at the end
+    decoded_segments = [_decode_5e(seg).hex().upper() for seg in raw_bytes.split(b'\x0D')[:-1] if seg]
     final_map, unassigned = process_by_second_marker(decoded_segments)
-    print(final_map, unassigned)
+    log.debug("%r %r", final_map, unassigned)
     return final_map, unassigned
\ No newline at end of file
@@ -5,6 +5,10 @@ def send_commands(host, port, commands):
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
             client_socket.connect((host, port))
+            # Small command frames: send immediately, ACK replies immediately (Linux)
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if hasattr(socket, "TCP_QUICKACK"):
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
             print(f"✅ Connected to {host}:{port}")
 
             for cmd in commands:
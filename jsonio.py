@@ -0,0 +1,56 @@
+# jsonio.py
+# ============================================================
+# JSON result / log writing shared by the reader and calibration scripts.
+# - Uses orjson when it is installed (much faster), stdlib json otherwise.
+# - Output stays indented (2 spaces) so operators can still read the files.
+# - Writes go through a temp file + os.replace, so a crash never leaves a
+#   half-written results file behind.
+# - load_json_cached: parse a JSON file once per change (keyed by mtime/size).
+# ============================================================
+
+import os
+import json
+import functools
+
+try:
+    import orjson  # optional: much faster JSON encoder
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, indent: bool = True) -> bytes:
+    """Serialize obj to JSON bytes (2-space indent unless indent=False)."""
+    if orjson is not None:
+        # int dict keys (e.g. results keyed by meter number) are allowed, as with json.dump
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, indent=2).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def write_json(path: str, obj, indent: bool = True) -> None:
+    """Atomically write obj as JSON to path (parent directory is created if needed)."""
+    data = dumps(obj, indent=indent)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_json_at(path: str, mtime_ns: int, size: int):
+    with open(path, "rb") as f:
+        data = f.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def load_json_cached(path: str):
+    """
+    Parsed JSON at path, re-read only when the file changes (mtime/size).
+    The same object is shared between callers, so treat it as read-only.
+    Raises like open()/json.load() if the file is missing or invalid.
+    """
+    st = os.stat(path)
+    return _load_json_at(path, st.st_mtime_ns, st.st_size)
@@ -11,7 +11,7 @@ Features
 - Polling always uses MCW1 … MCW10 (local IDs only).
 - Global numbering (1..METER_COUNT) preserved in logs.
 - Proper response decoding (split + escape handling).
-- After switching IP, waits 3 seconds before polling.
+- Waits 3 seconds before polling each IP; the IPs are polled in parallel.
 - Operator popup prompt to press UP, DOWN, ENTER.
 - Results saved as JSON and displayed as an SQL-like table.
 
@@ -22,69 +22,30 @@ Output
 """
 
 import os
+import re
 import time
 import json
-import re
-import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import messagebox
 
 import config
+from ui_root import get_root
 from transport import get_transport
 import steps
+from mcw_parse import split_segments, extract_meter_and_payload, decode_hex, response_complete
 
 
 # ============================================================
 # Helpers
 # ============================================================
 
-def split_segments(raw_bytes: bytes):
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-
-def extract_meter_and_payload(segment: str):
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    return (int(m.group(1)), m.group(2)) if m else (None, None)
-
-
-def decode_escapes(payload: str) -> str:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        elif payload[i] == "<":
-            m = re.match(r"<(\d{3})>", payload[i:])
-            if m:
-                v = int(m.group(1))
-                if 128 <= v <= 255:
-                    out.append(v)
-                    i += len(m.group(0))
-                    continue
-        out.append(ord(payload[i]))
-        i += 1
-    return out.hex().upper()
-
-
 def parse_key_response(raw: bytes, ip: str, start_global: int) -> dict:
     results = {}
     for seg in split_segments(raw):
         meter_id, payload = extract_meter_and_payload(seg)
         if meter_id and payload:
             global_id = start_global + (meter_id - 1)
-            results[global_id] = decode_escapes(payload)
+            results[global_id] = decode_hex(payload)
     return results
 
 
@@ -92,6 +53,19 @@ def get_local_meter_num(global_meter: int) -> int:
     return ((global_meter - 1) % 10) + 1
 
 
+def split_key_values(hex_data: str) -> dict:
+    """
+    {key: 8-digit hex float} from one KEY_REG_COUNT read reply starting at KEY_START_ADDR.
+    Data starts after slave + func + byte_count (6 hex digits); 4 hex digits per register.
+    Keys missing from a short or exception reply map to "".
+    """
+    values = {}
+    for key, addr in KEY_ADDRS.items():
+        start = 6 + 4 * (addr - KEY_START_ADDR)
+        values[key] = hex_data[start:start + 8] if len(hex_data) >= start + 8 else ""
+    return values
+
+
 def print_results_table(results: dict):
     headers = ["Meter", "UP", "DOWN", "ENTER"]
     print("\n+-------+-------+-------+--------+")
@@ -116,6 +90,9 @@ def print_results_table(results: dict):
 # ============================================================
 
 ONLY_CALIBRATED = True
+POLL_GAP = getattr(config, "POLL_GAP", 0.01)  # reads are reply-driven; only a small gap between commands
+KEY_READ_TIMEOUT = 2.0  # reply budget per read; a pipelined burst waits this times its size
+KEY_DRAIN_TIMEOUT = 0.05  # short read before a burst, to flush replies that arrived late
 CAL_RESULTS_FILE = config.CAL_RESULTS_JSON
 LOG_FILE = os.path.join(config.RESULTS_DIR, "key_test_log.json")
 
@@ -124,12 +101,18 @@ KEY_ADDRS = {
     "DOWN":  0x25C0,
     "ENTER": 0x25C2,
 }
+# The key registers are contiguous, so one read covers all three
+KEY_START_ADDR = min(KEY_ADDRS.values())
+KEY_REG_COUNT = max(KEY_ADDRS.values()) + 2 - KEY_START_ADDR  # 6 registers
+KEY_REPLY_LEN = 5 + 2 * KEY_REG_COUNT  # slave + func + byte_count + 12 data + CRC
 
 VALID_HEX = {
     "3F800000", "40400000", "40800000",
     "40A00000", "40C00000", "40E00000", "41000000",
     "41100000", "41200000"
 }
+# All valid values as one alternation, matched against each key's value
+_VALID_RE = re.compile("|".join(re.escape(v) for v in sorted(VALID_HEX)))
 
 
 # ============================================================
@@ -175,14 +158,103 @@ def load_calibrated_meters():
         return [], set(all_meters)
 
 def show_key_prompt_popup():
-    root = tk.Tk()
-    root.withdraw()
     messagebox.showinfo(
         "Key Press Required",
-        "Step 9:\n\nPress UP → DOWN → ENTER on all meters.\n\nClick OK to continue."
+        "Step 9:\n\nPress UP → DOWN → ENTER on all meters.\n\nClick OK to continue.",
+        parent=get_root(),
     )
 
 
+def poll_ip(idx: int, ip: str, port: int, all_meters, failed_meters) -> dict:
+    """
+    Steps 10–12 for one connection: poll UP/DOWN/ENTER on every meter behind ip.
+    Returns {global_meter: {key: status}} for the meters on this IP.
+    """
+    results = {}
+    start_global = idx * 10 + 1
+    print(f"\n--- Polling meters on {ip} ---")
+    time.sleep(3.0)
+
+    active = []
+    for offset in range(10):
+        global_meter = start_global + offset
+        if global_meter not in all_meters:
+            continue
+
+        # Skip failed meters but record CAL_FAIL
+        if global_meter in failed_meters:
+            results[global_meter] = {
+                "UP": "CAL_FAIL",
+                "DOWN": "CAL_FAIL",
+                "ENTER": "CAL_FAIL"
+            }
+            print(f"⚠️  Skipping meter {global_meter} (failed calibration).")
+            continue
+
+        results[global_meter] = {}
+        active.append(global_meter)
+
+    t = get_transport(ip)
+    try:
+        # UP/DOWN/ENTER for every meter on this IP in one pipelined burst: a single
+        # KEY_REG_COUNT read per meter returns all three keys, so each meter has one
+        # read in flight and its F<n> reply carries every key. Only meters with a key
+        # that has not passed are resent, after draining replies that arrived late.
+        cmd_of = {
+            g: steps.build_modbus_read_cmd(
+                meter_num=get_local_meter_num(g), slave_id=1,
+                start_addr=KEY_START_ADDR, reg_count=KEY_REG_COUNT
+            )
+            for g in active
+        }
+        status = {g: dict.fromkeys(KEY_ADDRS, "NO_DATA") for g in active}
+        pending = list(active)
+
+        for attempt in range(3):
+            if not pending:
+                break
+            if attempt:
+                t.recv_all(timeout=KEY_DRAIN_TIMEOUT)  # discard stale replies
+            t.send_mcw_batch([cmd_of[g] for g in pending])
+            waiting = [get_local_meter_num(g) for g in pending]
+            # Same per-read budget the serial loop gave each transaction
+            raw = t.recv_until(
+                lambda d: all(response_complete(d, n, KEY_REPLY_LEN) for n in waiting),
+                timeout=KEY_READ_TIMEOUT * len(pending),
+            )
+            parsed = parse_key_response(raw, ip, start_global)
+
+            still_pending = []
+            for g in pending:
+                hex_data = parsed.get(g, "")
+                print(f"[DEBUG] Meter {g} keys decoded: {hex_data}")
+                values = split_key_values(hex_data)
+
+                for key, value in values.items():
+                    if status[g][key] == "PASS":
+                        continue  # passed on an earlier attempt
+                    if not hex_data:
+                        status[g][key] = "NO_DATA"
+                    elif _VALID_RE.fullmatch(value) is not None:
+                        status[g][key] = "PASS"
+                    else:
+                        status[g][key] = "FAIL"
+                if any(s != "PASS" for s in status[g].values()):
+                    still_pending.append(g)
+            pending = still_pending
+
+            if pending:
+                time.sleep(POLL_GAP)
+
+        for g in active:
+            for key in KEY_ADDRS:
+                results[g][key] = status[g][key]
+                print(f"  Meter {g}: {key} = {status[g][key]}")
+    finally:
+        t.close()
+    return results
+
+
 def run_key_tests():
     passed_meters, failed_meters = load_calibrated_meters()
     all_meters = list(range(1, config.METER_COUNT + 1))
@@ -207,62 +279,12 @@ def run_key_tests():
     if config.ALLOW_OPERATOR_PROMPTS:
         show_key_prompt_popup()
 
-    # Step 10–12: Polling per port
-    for idx, (ip, port) in enumerate(config.METER_CONNECTIONS):
-        start_global = idx * 10 + 1
-        print(f"\n--- Polling meters on {ip} ---")
-        time.sleep(3.0)
-        t = get_transport(ip)
-        try:
-            for offset in range(10):
-                global_meter = start_global + offset
-                if global_meter not in all_meters:
-                    continue
-
-                # Skip failed meters but record CAL_FAIL
-                if global_meter in failed_meters:
-                    results[global_meter] = {
-                        "UP": "CAL_FAIL",
-                        "DOWN": "CAL_FAIL",
-                        "ENTER": "CAL_FAIL"
-                    }
-                    print(f"⚠️  Skipping meter {global_meter} (failed calibration).")
-                    continue
-
-                local_id = get_local_meter_num(global_meter)
-                results[global_meter] = {}
-
-                for key, addr in KEY_ADDRS.items():
-                    cmd = steps.build_modbus_read_cmd(
-                        meter_num=local_id, slave_id=1,
-                        start_addr=addr, reg_count=2
-                    )
-
-                    status, attempt = "NO_DATA", 0
-                    while attempt < 3:
-                        t.send_mcw(cmd)
-                        raw = t.recv_all(timeout=2.0)
-                        parsed = parse_key_response(raw, ip, start_global)
-                        hex_data = parsed.get(global_meter, "")
-
-                        print(f"[DEBUG] Meter {global_meter} {key} decoded: {hex_data}")
-
-                        if not hex_data:
-                            status = "NO_DATA"
-                        elif any(v in hex_data for v in VALID_HEX):
-                            status = "PASS"
-                            break
-                        else:
-                            status = "FAIL"
-
-                        attempt += 1
-                        time.sleep(0.3)
-
-                    results[global_meter][key] = status
-                    print(f"  Meter {global_meter}: {key} = {status}")
-                    time.sleep(0.3)
-        finally:
-            t.close()
+    # Step 10–12: Polling per port (connections are independent, so poll them side by side)
+    with ThreadPoolExecutor(max_workers=max(1, len(config.METER_CONNECTIONS))) as ex:
+        futures = [ex.submit(poll_ip, idx, ip, port, all_meters, failed_meters)
+                   for idx, (ip, port) in enumerate(config.METER_CONNECTIONS)]
+        for fut in futures:
+            results.update(fut.result())
 
     # Save JSON log
     os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
@@ -0,0 +1,120 @@
+# mcw_parse.py
+# ============================================================
+# Shared helpers for decoding MCW gateway replies.
+# - split_segments / extract_meter_and_payload: raw reply -> (meter, payload)
+# - decode_escapes: escaped payload text -> raw Modbus frame bytes
+#   (pure ^hXX frames via one bytes.fromhex, anything else via one regex pass
+#   whose callback only does table lookups)
+# - decode_hex: same, as an uppercase hex string
+# - response_complete: has the full reply for one meter arrived yet?
+# - complete_reply_counts: how many full replies each meter has sent so far
+#
+# Escapes used by the gateway:
+#   ^hXX   -> byte 0xXX
+#   ^X     -> control character (X & 0x1F)
+#   <NNN>  -> byte NNN (only 128..255, anything else is literal text)
+# ============================================================
+
+import re
+
+# Reply segment 'F<meter>,<echo>,<payload>' (bytes, no latin1 round-trip)
+_F_SEG = re.compile(rb"F(\d+),[^,]*,(.*)")
+
+# One compiled pattern; the regex engine scans the literal runs in C.
+# <NNN> only matches 128..255, so other <ddd> runs are left as literal text by the regex itself
+_ESC_RE = re.compile(rb"\^h([0-9A-Fa-f]{2})|\^(.)|<(1[3-9]\d|12[89]|2[0-4]\d|25[0-5])>", re.S)
+
+# Prebuilt single-byte results, and every two-digit hex pair (any case) -> its byte
+_BYTE = tuple(bytes((v,)) for v in range(256))
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+_HEX = {bytes((a, b)): _BYTE[int(bytes((a, b)), 16)] for a in _HEX_DIGITS for b in _HEX_DIGITS}
+
+
+def split_segments(raw_bytes: bytes) -> list:
+    """Non-blank CR-separated segments of a raw reply, kept as bytes."""
+    # Split first, then trim only the outer two segments: same result as stripping the
+    # whole buffer, without copying it
+    segs = [seg for seg in raw_bytes.split(b"\r") if seg.strip()]
+    if segs:
+        segs[0] = segs[0].lstrip()
+        segs[-1] = segs[-1].rstrip()
+    return segs
+
+
+def extract_meter_and_payload(segment: bytes):
+    """(meter id, escaped payload bytes) for an 'F<n>,...' reply; (None, None) for echoes/noise."""
+    if segment.startswith(b"MCW"):
+        return None, None
+    m = _F_SEG.match(segment)
+    return (int(m.group(1)), m.group(2)) if m else (None, None)
+
+
+def _unescape(m) -> bytes:
+    hx, ctrl, dec = m.groups()
+    if hx is not None:
+        return _HEX[hx]
+    if ctrl is not None:
+        return _BYTE[ctrl[0] & 0x1F]
+    return _BYTE[int(dec)]
+
+
+def decode_escapes(payload) -> bytes:
+    """Decode an escaped MCW payload (str or bytes) into raw frame bytes."""
+    buf = payload.encode("latin1") if isinstance(payload, str) else bytes(payload)
+    if b"^" not in buf and b"<" not in buf:
+        return buf  # nothing escaped
+    # Gateway frames are usually nothing but ^hXX groups: decode those with one C-level
+    # bytes.fromhex instead of a Python callback per byte
+    n = len(buf) // 4
+    if len(buf) % 4 == 0 and buf[0::4] == b"^" * n and buf[1::4] == b"h" * n:
+        digits = buf.replace(b"^h", b"")
+        if len(digits) == 2 * n:
+            try:
+                out = bytes.fromhex(digits.decode("latin1"))
+            except ValueError:
+                out = None
+            if out is not None and len(out) * 4 == len(buf):
+                return out
+    return _ESC_RE.sub(_unescape, buf)
+
+
+def decode_hex(payload) -> str:
+    """decode_escapes as an uppercase hex string (the form the calibration scripts compare)."""
+    return decode_escapes(payload).hex().upper()
+
+
+def response_complete(raw: bytes, local_id: int, expected_len: int) -> bool:
+    """
+    True once raw holds a CR-terminated reply from MCW<local_id> whose decoded frame
+    is at least expected_len bytes (CRC included), or is a Modbus exception reply.
+    Lets callers stop reading the moment the reply is in instead of draining to timeout.
+    """
+    head = b"F%d," % local_id
+    for seg in raw.split(b"\r")[:-1]:  # last piece may still be arriving
+        if not seg.startswith(head):
+            continue
+        parts = seg.split(b",", 2)
+        if len(parts) < 3:
+            continue
+        frame = decode_escapes(parts[2])
+        if len(frame) >= expected_len or (len(frame) >= 5 and frame[1] & 0x80):
+            return True
+    return False
+
+
+def complete_reply_counts(raw: bytes, expected_len: int) -> dict:
+    """
+    {local meter id: number of complete replies} among the CR-terminated 'F<n>,' segments
+    in raw, using the same completeness rule as response_complete. For callers that
+    pipeline several commands to one meter and wait for all of their replies.
+    """
+    counts = {}
+    for seg in raw.split(b"\r")[:-1]:  # last piece may still be arriving
+        m = _F_SEG.match(seg)
+        if not m:
+            continue
+        frame = decode_escapes(m.group(2))
+        if len(frame) >= expected_len or (len(frame) >= 5 and frame[1] & 0x80):
+            n = int(m.group(1))
+            counts[n] = counts.get(n, 0) + 1
+    return counts
@@ -6,12 +6,18 @@ postcal_modern_ui.py — Post-Calibration Programming with UI Prompts
 
 import os
 import time
-import json
 import struct
+import array
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import simpledialog, messagebox
 from transport import SocketTransport
+from jsonio import write_json, load_json_cached
+from mcw_parse import split_segments, extract_meter_and_payload, decode_escapes, complete_reply_counts
 import config  # Import METER_COUNT from your config.py
+from ui_root import get_root
 
 # -------------------------
 # Configuration
@@ -19,6 +25,7 @@ import config  # Import METER_COUNT from your config.py
 METER_COUNT = getattr(config, "METER_COUNT", 3)
 MAX_RETRIES = 1
 SOCKET_TIMEOUT = 2.0
+WRITE_REPLY_LEN = 8  # write-multiple reply: slave + func + addr + count + CRC
 
 RESULTS_DIR = r"C:\Users\rishabhd4\Desktop\Logs Sarvesh"
 FILES_TO_CHECK = ["4W.json", "3W.json"]
@@ -32,16 +39,42 @@ MODEL_CODES = {
 # -------------------------
 # CRC16 and MCW Utilities
 # -------------------------
-def crc16_fn(data: bytes) -> int:
-    crc = 0xFFFF
-    for b in data:
-        crc ^= b
+def _make_crc16_table():
+    table = array.array('H')
+    for b in range(256):
+        crc = b
         for _ in range(8):
             crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
-    return crc & 0xFFFF
+        table.append(crc)
+    return table
+
+def _make_slice_table(prev, base):
+    # Table for a byte that still has one more byte to pass through after it
+    return array.array('H', [(v >> 8) ^ base[v & 0xFF] for v in prev])
+
+# Modbus CRC16 (poly 0xA001) tables, built once at import.
+# T0 is the per-byte table; T1..T3 let crc16_fn consume 4 bytes per step (slicing-by-4)
+_CRC16_TABLE = _make_crc16_table()
+_CRC16_T1 = _make_slice_table(_CRC16_TABLE, _CRC16_TABLE)
+_CRC16_T2 = _make_slice_table(_CRC16_T1, _CRC16_TABLE)
+_CRC16_T3 = _make_slice_table(_CRC16_T2, _CRC16_TABLE)
+
+def crc16_fn(data: bytes, _t0=_CRC16_TABLE, _t1=_CRC16_T1, _t2=_CRC16_T2, _t3=_CRC16_T3) -> int:
+    crc = 0xFFFF
+    n = len(data)
+    end4 = n - (n % 4)
+    for i in range(0, end4, 4):
+        crc ^= data[i] | (data[i + 1] << 8)
+        crc = _t3[crc & 0xFF] ^ _t2[crc >> 8] ^ _t1[data[i + 2]] ^ _t0[data[i + 3]]
+    for i in range(end4, n):
+        crc = (crc >> 8) ^ _t0[(crc ^ data[i]) & 0xFF]
+    return crc
 
-def bytes_to_mcw_hex(byte_seq: bytes) -> str:
-    return ''.join(f"^h{b:02X}" for b in byte_seq)
+# '^h00'..'^hFF' for every byte value, formatted once
+_MCW_HEX = [f"^h{b:02X}" for b in range(256)]
+
+def bytes_to_mcw_hex(byte_seq: bytes, _h=_MCW_HEX) -> str:
+    return ''.join([_h[b] for b in byte_seq])
 
 def build_simple_mcw(meter_num: int, raw_bytes: bytes) -> str:
     return f"MCW{meter_num},{bytes_to_mcw_hex(raw_bytes)}"
@@ -50,24 +83,41 @@ def build_simple_mcw(meter_num: int, raw_bytes: bytes) -> str:
 # Modbus Float Writers
 # -------------------------
 def build_modbus_write_float(meter_num, slave_id, start_addr, value, fixed_crc=None):
-    fbytes = struct.pack('>f', float(value))
-    high_word, low_word = struct.unpack('>HH', fbytes)
-    regs_bytes = struct.pack('>HH', high_word, low_word)
+    # Key the cache on the float32 bit pattern actually sent; the frame body does not
+    # depend on the meter, so retries and every meter's unlock/model writes share it
+    value_bits = _U32.unpack(_F32.pack(float(value)))[0]
+    return f"MCW{meter_num},{_write_float_body(slave_id, start_addr, value_bits, fixed_crc)}"
+
+# Precompiled layouts; the frame is packed into one reusable buffer, guarded by a lock
+# because the per-IP workers build frames concurrently
+_F32 = struct.Struct('>f')
+_U32 = struct.Struct('>I')
+_WRITE_HDR_VAL = struct.Struct('>BBHHBI')  # slave, 0x10, addr, reg count, byte count, float bits
+_CRC_LE = struct.Struct('<H')
+_PDU_BUF = bytearray(_WRITE_HDR_VAL.size + _CRC_LE.size)
+_PDU_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=4096)
+def _write_float_body(slave_id, start_addr, value_bits, fixed_crc):
     reg_count = 2
     byte_count = reg_count * 2
-    header = struct.pack('>B B H H B', slave_id, 0x10, start_addr, reg_count, byte_count)
-    pdu = header + regs_bytes
-    if fixed_crc is not None:
-        pdu_full = pdu + struct.pack('<H', fixed_crc)
-    else:
-        crc = crc16_fn(pdu)
-        pdu_full = pdu + struct.pack('<H', crc)
-    return build_simple_mcw(meter_num, pdu_full)
+    with _PDU_LOCK:
+        buf = _PDU_BUF
+        _WRITE_HDR_VAL.pack_into(buf, 0, slave_id, 0x10, start_addr, reg_count, byte_count, value_bits)
+        if fixed_crc is not None:
+            crc = fixed_crc
+        else:
+            crc = crc16_fn(memoryview(buf)[:_WRITE_HDR_VAL.size])
+        _CRC_LE.pack_into(buf, _WRITE_HDR_VAL.size, crc)
+        return bytes_to_mcw_hex(buf)
 
 # -------------------------
 # Specific Commands
 # -------------------------
 def build_unlock_command(meter_num, addr, code=2121):
+    body = _UNLOCK_BODY.get(addr) if code == 2121 else None
+    if body is not None:
+        return f"MCW{meter_num},{body}"
     return build_modbus_write_float(meter_num, 1, addr, float(code))
 
 def build_serial_command(meter_num, serial):
@@ -80,20 +130,28 @@ def build_yymm_command(meter_num, yymm_val=None):
     return build_modbus_write_float(meter_num, 1, 0x17A8, float(yymm_val))
 
 def build_model_command(meter_num, code):
+    body = _MODEL_BODY.get(code)
+    if body is not None:
+        return f"MCW{meter_num},{body}"
     return build_modbus_write_float(meter_num, 1, 0x17AE, float(code))
 
+def _float_body(addr, value):
+    return _write_float_body(1, addr, _U32.unpack(_F32.pack(float(value)))[0], None)
+
+# Fixed frames precomputed at import: only the MCW<n> prefix changes per meter
+_UNLOCK_BODY = {addr: _float_body(addr, 2121) for addr in (0x17A6, 0x17A8, 0x17AE)}
+_MODEL_BODY = {c: _float_body(0x17AE, c) for types in MODEL_CODES.values() for c in types.values()}
+
 # -------------------------
 # UI Helpers
 # -------------------------
 def prompt_serial_number():
-    root = tk.Tk()
-    root.withdraw()
+    root = get_root()
     while True:
-        serial = simpledialog.askstring("Serial Number", "Enter starting serial number (6 digits):")
+        serial = simpledialog.askstring("Serial Number", "Enter starting serial number (6 digits):", parent=root)
         if serial and serial.isdigit() and len(serial) == 6:
-            root.destroy()
             return int(serial)
-        messagebox.showerror("Invalid Input", "Serial number must be 6 digits.")
+        messagebox.showerror("Invalid Input", "Serial number must be 6 digits.", parent=root)
 
 def select_model_and_type():
     selection = {}
@@ -103,7 +161,7 @@ def select_model_and_type():
         selection['type'] = type_var.get()
         top.destroy()
 
-    top = tk.Tk()
+    top = tk.Toplevel(get_root())
     top.title("Select Model and Type")
     tk.Label(top, text="Select Model:").pack()
     model_var = tk.StringVar(value=list(MODEL_CODES.keys())[0])
@@ -127,7 +185,7 @@ def select_model_and_type():
     model_var.trace_add("write", rebuild_types)
     rebuild_types()
     tk.Button(top, text="Submit", command=on_submit).pack()
-    top.mainloop()
+    top.wait_window()
 
     if selection.get('model') and selection.get('type'):
         return selection['model'], selection['type']
@@ -138,10 +196,6 @@ def select_model_and_type():
 # -------------------------
 # Utilities
 # -------------------------
-def send_with_delay(transport, cmd, delay=1.0):
-    time.sleep(delay)
-    transport.send_mcw(cmd)
-
 def get_ip_for_meter(meter_id):
     if 1 <= meter_id <= 10:
         ip = "192.168.100.100"
@@ -152,26 +206,51 @@ def get_ip_for_meter(meter_id):
     port = 12345
     return ip, port
 
+# One persistent transport per (ip, port) for the whole run
+_TRANSPORTS = {}
+
+def _get_transport(ip, port):
+    t = _TRANSPORTS.get((ip, port))
+    if t is None:
+        t = _TRANSPORTS[(ip, port)] = SocketTransport(ip, port, SOCKET_TIMEOUT)
+    return t
+
+def _close_transports():
+    for t in _TRANSPORTS.values():
+        t.close()
+    _TRANSPORTS.clear()
+
 def get_current_yymm_int():
     t = time.localtime()
     return (t.tm_year % 100) * 100 + t.tm_mon
 
-def decode_response(raw):
-    try:
-        if raw is None:
-            return None
-        if isinstance(raw, bytes):
-            raw = raw.hex()
-        return raw[-8:]
-    except Exception:
-        return None
+def write_acks(raw, mcw_num, limit=None):
+    """
+    One flag per reply from MCW<mcw_num>, in arrival order:
+    True for a normal write-multiple (0x10) reply, False for an exception/garbled frame.
+    Stops after `limit` replies when given (callers that only check the first few).
+    Only the function-code byte is looked at, so no hex/CRC work is done per reply.
+    """
+    acks = []
+    if not raw:
+        return acks
+    for seg in split_segments(raw):
+        meter, payload = extract_meter_and_payload(seg)
+        if meter != mcw_num or payload is None:
+            continue
+        frame = decode_escapes(payload)
+        acks.append(len(frame) >= 2 and frame[1] == 0x10)
+        if limit is not None and len(acks) >= limit:
+            break
+    return acks
 
 def save_logs(summary):
-    with open("postcal_log.json", "w") as jf:
-        json.dump(summary, jf, indent=2)
+    write_json("postcal_log.json", summary)
     with open("postcal_log.txt", "w") as tf:
-        for entry in summary["meters"]:
-            tf.write(f"{entry['name']}: {entry['status']} | Response: {entry.get('received')}\n")
+        tf.write("".join(
+            f"{entry['name']}: {entry['status']} | Response: {entry.get('received')}\n"
+            for entry in summary["meters"]
+        ))
 
 def print_table(results):
     print("\n+-------+----------------------+------------------------------+")
@@ -193,15 +272,14 @@ def load_caldone_success_meters():
         print(f"⚠️ caldone_log.json not found at {CALDONE_LOG_PATH}. All meters skipped.")
         return success_meters
     try:
-        with open(CALDONE_LOG_PATH, "r") as f:
-            data = json.load(f)
-            if isinstance(data, dict):
-                for k, v in data.items():
-                    try:
-                        if isinstance(v, dict) and v.get("result") == "CAL_SUCCESS":
-                            success_meters.add(int(k))
-                    except Exception:
-                        continue
+        data = load_json_cached(CALDONE_LOG_PATH)
+        if isinstance(data, dict):
+            for k, v in data.items():
+                try:
+                    if isinstance(v, dict) and v.get("result") == "CAL_SUCCESS":
+                        success_meters.add(int(k))
+                except Exception:
+                    continue
     except Exception as e:
         print(f"⚠️ Error reading caldone_log.json: {e}")
     return success_meters
@@ -209,27 +287,19 @@ def load_caldone_success_meters():
 # -------------------------
 # Main Routine
 # -------------------------
-def run_post_calibration():
-    caldone_success = load_caldone_success_meters()
-    if not caldone_success:
-        print("⚠️ No meters with CAL_SUCCESS found — skipping all operations.")
-        return
-    else:
-        print(f"✅ Proceeding only for meters with CAL_SUCCESS: {sorted(caldone_success)}")
-
-    serial_start = prompt_serial_number()
-    model, meter_type = select_model_and_type()
-    code = MODEL_CODES[model][meter_type]
-    curr_serial = serial_start
-
-    print("⏳ Waiting 5 seconds before starting writes...")
-    time.sleep(5)
-
+def run_ip_group(ip, port, meter_ids, caldone_success, serial_start, code):
+    """
+    Post-cal writes for the meters behind one (ip, port), in meter order, on one
+    persistent connection. Serials count up from serial_start for each meter written.
+    Returns the log entries for these meters.
+    """
     results = []
-    last_connection = None
+    curr_serial = serial_start
     mcw_counter = 1  # MCW numbering per connection
+    connected = False
+    yymm_val = get_current_yymm_int()  # same for every meter in the run
 
-    for meter_id in range(1, METER_COUNT + 1):
+    for meter_id in meter_ids:
         if meter_id not in caldone_success:
             print(f"⚠️ Skipping meter {meter_id} (not CAL_SUCCESS).")
             results.append({
@@ -241,63 +311,48 @@ def run_post_calibration():
             continue  # skip faulty but DO NOT increment serial
 
         # ✅ normal write for good meters only
-        ip, port = get_ip_for_meter(meter_id)
-        if last_connection != (ip, port):
-            print(f"\n>> Meter {meter_id} targeting {ip}:{port}")
+        print(f"\n>> Meter {meter_id} targeting {ip}:{port}")
+        if not connected:
             print(" ⏳ New connection detected, waiting 3 seconds...")
             time.sleep(3)
-            last_connection = (ip, port)
-            mcw_counter = 1
-        else:
-            print(f"\n>> Meter {meter_id} targeting {ip}:{port}")
+            connected = True
 
         entry = {"name": f"meter {meter_id}", "meter": meter_id, "received": "", "status": "COMM_ERROR"}
 
         try:
+            transport = _get_transport(ip, port)
+
+            # unlock/serial, unlock/yymm, unlock/model go out as one write; the meter
+            # executes them in order on its MCW channel and answers each one
+            cmds = [
+                build_unlock_command(mcw_counter, 0x17A6),
+                build_serial_command(mcw_counter, f"{curr_serial:06d}"),
+                build_unlock_command(mcw_counter, 0x17A8),
+                build_yymm_command(mcw_counter, yymm_val),
+                build_unlock_command(mcw_counter, 0x17AE),
+                build_model_command(mcw_counter, code),
+            ]
+            n = mcw_counter
             for attempt in range(1, MAX_RETRIES + 1):
-                cmd_unlock = build_unlock_command(mcw_counter, 0x17A6)
-                send_with_delay(SocketTransport(ip, port, SOCKET_TIMEOUT), cmd_unlock)
-                raw = SocketTransport(ip, port, SOCKET_TIMEOUT).recv_all(SOCKET_TIMEOUT)
-                if decode_response(raw):
-                    break
-                time.sleep(0.3)
-
-            for attempt in range(1, MAX_RETRIES + 1):
-                cmd_write = build_serial_command(mcw_counter, f"{curr_serial:06d}")
-                send_with_delay(SocketTransport(ip, port, SOCKET_TIMEOUT), cmd_write)
-                raw = SocketTransport(ip, port, SOCKET_TIMEOUT).recv_all(SOCKET_TIMEOUT)
-                if decode_response(raw):
+                transport.send_mcw_batch(cmds)
+                # six writes answered in turn: one reply time each
+                raw = transport.recv_until(
+                    lambda d: complete_reply_counts(d, WRITE_REPLY_LEN).get(n, 0) >= len(cmds),
+                    timeout=SOCKET_TIMEOUT * len(cmds),
+                )
+                # Replies map to cmds by position only when every write answered exactly
+                # once; otherwise a missing reply shifts them, so the attempt stays COMM_ERROR
+                answered = complete_reply_counts(raw, WRITE_REPLY_LEN).get(n, 0)
+                acks = write_acks(raw, n, limit=2) if answered == len(cmds) else []
+                if acks == [True, True]:  # serial unlock and serial write both acknowledged
                     entry["received"] += f"Serial {curr_serial:06d} written | "
                     entry["status"] = "PASS"
                     break
-                time.sleep(0.3)
+                if attempt < MAX_RETRIES:
+                    # the read above already waited for the replies; back off only before a resend
+                    time.sleep(min(0.05 * 2 ** attempt, 0.3))
             curr_serial += 1  # ✅ increment serial only for successful meter
 
-            for attempt in range(1, MAX_RETRIES + 1):
-                cmd_unlock = build_unlock_command(mcw_counter, 0x17A8)
-                send_with_delay(SocketTransport(ip, port, SOCKET_TIMEOUT), cmd_unlock)
-                SocketTransport(ip, port, SOCKET_TIMEOUT).recv_all(SOCKET_TIMEOUT)
-                time.sleep(0.3)
-
-            yymm_val = get_current_yymm_int()
-            for attempt in range(1, MAX_RETRIES + 1):
-                cmd_write = build_yymm_command(mcw_counter, yymm_val)
-                send_with_delay(SocketTransport(ip, port, SOCKET_TIMEOUT), cmd_write)
-                SocketTransport(ip, port, SOCKET_TIMEOUT).recv_all(SOCKET_TIMEOUT)
-                time.sleep(0.3)
-
-            for attempt in range(1, MAX_RETRIES + 1):
-                cmd_unlock = build_unlock_command(mcw_counter, 0x17AE)
-                send_with_delay(SocketTransport(ip, port, SOCKET_TIMEOUT), cmd_unlock)
-                SocketTransport(ip, port, SOCKET_TIMEOUT).recv_all(SOCKET_TIMEOUT)
-                time.sleep(0.3)
-
-            for attempt in range(1, MAX_RETRIES + 1):
-                cmd_write = build_model_command(mcw_counter, code)
-                send_with_delay(SocketTransport(ip, port, SOCKET_TIMEOUT), cmd_write)
-                SocketTransport(ip, port, SOCKET_TIMEOUT).recv_all(SOCKET_TIMEOUT)
-                time.sleep(0.3)
-
             mcw_counter += 1
             results.append(entry)
 
@@ -305,6 +360,47 @@ def run_post_calibration():
             print(f"❌ Meter {meter_id} failed: {e}")
             results.append(entry)
 
+    return results
+
+def run_post_calibration():
+    caldone_success = load_caldone_success_meters()
+    if not caldone_success:
+        print("⚠️ No meters with CAL_SUCCESS found — skipping all operations.")
+        return
+    else:
+        print(f"✅ Proceeding only for meters with CAL_SUCCESS: {sorted(caldone_success)}")
+
+    serial_start = prompt_serial_number()
+    model, meter_type = select_model_and_type()
+    code = MODEL_CODES[model][meter_type]
+
+    print("⏳ Waiting 5 seconds before starting writes...")
+    time.sleep(5)
+
+    # Meters grouped by connection; each group is written by its own worker. Serial
+    # ranges are handed out up front in meter order (one per CAL_SUCCESS meter), so
+    # numbering matches a sequential run
+    groups = {}
+    for meter_id in range(1, METER_COUNT + 1):
+        groups.setdefault(get_ip_for_meter(meter_id), []).append(meter_id)
+    starts, next_serial = {}, serial_start
+    for key, meter_ids in groups.items():
+        starts[key] = next_serial
+        next_serial += sum(1 for m in meter_ids if m in caldone_success)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as ex:
+            futures = [
+                ex.submit(run_ip_group, ip, port, meter_ids, caldone_success, starts[(ip, port)], code)
+                for (ip, port), meter_ids in groups.items()
+            ]
+            for fut in futures:
+                results.extend(fut.result())
+    finally:
+        _close_transports()
+    results.sort(key=lambda e: e["meter"])
+
     summary = {"run_time": time.ctime(), "meters": results}
     save_logs(summary)
     print_table(results)
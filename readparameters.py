@@ -15,47 +15,15 @@ Read Parameters Script with Key Test Integration
 
 import os
 import re
-import json
 import time
 import struct
-from typing import Dict, List, Tuple
+from typing import Dict, List
 
 import config
 from transport import get_transport
 from steps import build_modbus_read_cmd
-
-# ==========================================================
-# Decoder helpers
-# ==========================================================
-def split_segments(raw_bytes: bytes) -> List[str]:
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-def extract_meter_and_payload(segment: str) -> Tuple[int, str]:
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    return (int(m.group(1)), m.group(2)) if m else (None, None)
-
-def decode_escapes(payload: str) -> bytes:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        out.append(ord(payload[i]))
-        i += 1
-    return bytes(out)
+from mcw_parse import decode_escapes
+from jsonio import write_json, load_json_cached
 
 # ==========================================================
 # Param register map
@@ -66,28 +34,35 @@ PARAM_REGS = [
     ("watt_L1",    0x000C), ("watt_L2",    0x000E), ("watt_L3",    0x0010),
 ]
 
-def validate_value(name: str, value: float) -> bool:
-    if value is None:
-        return False
-    if "voltage" in name and not (220.0 <= value <= 240.0):
-        return False
-    if "current" in name and not (4.0 <= value <= 5.5):
-        return False
-    if "watt" in name and not (0.0 <= value <= 1500.0):
-        return False
-    return True
-
 # ==========================================================
 # Response parser
 # ==========================================================
+# 'F<n>,<echo>,<payload>' replies, found in one scan over the raw buffer (bytes, no split).
+# Only matches at the start of a CR-separated segment (or after leading blank space in the
+# buffer, e.g. the LF a CRLF gateway leaves), so MCW echoes are never picked up
+_SEG_RE = re.compile(rb"(?:\A\s*|(?<=\r))F(\d+),[^,\r]*,([^\r\n]*)")
+
+# Precompiled decoder for the whole PARAM_REGS block (big-endian floats, in register order)
+_PARAMS_BE = struct.Struct(">%df" % len(PARAM_REGS)).unpack_from
+
+# (min, max) per PARAM_REGS entry, so the parse loop does one comparison per value
+_PARAM_LIMITS = tuple(
+    (220.0, 240.0) if "voltage" in name else
+    (4.0, 5.5) if "current" in name else
+    (0.0, 1500.0) if "watt" in name else
+    (float("-inf"), float("inf"))
+    for name, _ in PARAM_REGS
+)
+
 def parse_meter_response(raw: bytes, local_id: int, global_id: int) -> Dict:
     res = {"global_meter": global_id, "local_meter": local_id, "params": {}}
-    segments = split_segments(raw)
-    for seg in segments:
-        if seg.startswith(f"MCW{local_id}"):
+    for m in _SEG_RE.finditer(raw):
+        if int(m.group(1)) != local_id:
             continue
-        m_id, payload = extract_meter_and_payload(seg)
-        if m_id != local_id or not payload:
+        payload = m.group(2)
+        if not raw[m.end():].strip():
+            payload = payload.rstrip()  # last segment: trailing blank space is not payload
+        if not payload:
             continue
         frame = decode_escapes(payload)
         if len(frame) < 5:
@@ -98,16 +73,12 @@ def parse_meter_response(raw: bytes, local_id: int, global_id: int) -> Dict:
         data = frame[3:3 + byte_count]
         if len(data) < 36:
             continue
-        for i, (name, _) in enumerate(PARAM_REGS):
-            start, end = i * 4, (i + 1) * 4
-            try:
-                val = struct.unpack(">f", data[start:end])[0]
-                if validate_value(name, val):
-                    res["params"][name] = {"value": val}
-                else:
-                    res["params"][name] = {"value": val, "warning": "out_of_range"}
-            except Exception as e:
-                res["params"][name] = {"value": None, "error": str(e)}
+        # All nine floats in one unpack, then one range check per value
+        for (name, _), val, (lo, hi) in zip(PARAM_REGS, _PARAMS_BE(data), _PARAM_LIMITS):
+            if lo <= val <= hi:
+                res["params"][name] = {"value": val}
+            else:
+                res["params"][name] = {"value": val, "warning": "out_of_range"}
         break
     if not res["params"]:
         res["error"] = "no_valid_frame"
@@ -141,12 +112,14 @@ def get_ip_and_local(global_meter: int):
 # ==========================================================
 # Load key test results
 # ==========================================================
+# Key-test outcomes that exclude a meter from reading
+_FAIL_TAGS = frozenset(("CAL_FAIL", "FAIL", "NO_DATA"))
+
 def load_key_test_results():
     try:
-        with open(os.path.join(config.RESULTS_DIR, "key_test_log.json"), "r") as f:
-            data = json.load(f)
+        data = load_json_cached(os.path.join(config.RESULTS_DIR, "key_test_log.json"))
         failed_meters = {int(m) for m, vals in data.items()
-                         if any(v == "CAL_FAIL" or v == "FAIL" or v == "NO_DATA" for v in vals.values())}
+                         if not _FAIL_TAGS.isdisjoint(vals.values())}
         print(f"[INFO] Loaded key test results: {len(failed_meters)} meters failed key test.")
         return failed_meters
     except Exception as e:
@@ -157,10 +130,8 @@ def load_key_test_results():
 # Save results
 # ==========================================================
 def save_results(results: List[Dict]):
-    os.makedirs(config.RESULTS_DIR, exist_ok=True)
     out_file = os.path.join(config.RESULTS_DIR, "meters_params.json")
-    with open(out_file, "w") as f:
-        json.dump(results, f, indent=2)
+    write_json(out_file, results)
     print(f"[INFO] Results saved to {out_file}")
 
 # ==========================================================
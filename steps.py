@@ -14,6 +14,7 @@
 # ============================================================
 
 import struct
+import functools
 from datetime import datetime
 import registers
 import config  # For METER_COUNT, SIMULATE, etc.
@@ -22,25 +23,43 @@ import config  # For METER_COUNT, SIMULATE, etc.
 # -------------------------------
 # CRC16 Modbus calculation
 # -------------------------------
-def crc16_fn(data: bytes) -> int:
+# Pure Python on purpose: read PDUs are 6 bytes, where the table loop costs ~0.5 us,
+# less than a numba/numpy call would spend just wrapping the bytes in an array.
+# Repeated read frames are cached by their builders instead.
+# (binascii.crc_hqx is CRC-CCITT, poly 0x1021, so the stdlib has no C routine for the
+# Modbus CRC; a compiled/PCLMUL version would need a build step this project does not have.)
+def _crc16_table_entry(b: int) -> int:
+    """CRC16 (poly 0xA001) of a single byte value, bit by bit."""
+    crc = b
+    for _ in range(8):
+        crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+# Built once at import: one lookup per byte instead of 8 shift/xor steps
+# Every PDU built here is short (reads 6 bytes, single-float writes 11), so there is no
+# slice-by-2 path for long PDUs: its 64K-entry table would never be used.
+CRC16_MODBUS_TABLE = tuple(_crc16_table_entry(i) for i in range(256))
+
+
+def crc16_fn(data: bytes, _t=CRC16_MODBUS_TABLE) -> int:
     """Compute Modbus CRC16 for a given byte stream."""
     crc = 0xFFFF
     for b in data:
-        crc ^= b
-        for _ in range(8):
-            if crc & 1:
-                crc = (crc >> 1) ^ 0xA001
-            else:
-                crc >>= 1
-    return crc & 0xFFFF
+        crc = (crc >> 8) ^ _t[(crc ^ b) & 0xFF]
+    return crc
 
 
 # -------------------------------
 # Convert raw bytes to ^h notation
 # -------------------------------
-def bytes_to_mcw_hex(byte_seq: bytes) -> str:
+# '^h00'..'^hFF' for every byte value, formatted once
+_MCW_HEX = tuple(f"^h{b:02X}" for b in range(256))
+
+
+def bytes_to_mcw_hex(byte_seq: bytes, _h=_MCW_HEX) -> str:
     """Convert bytes to MCW ^hXX notation string."""
-    return ''.join(f"^h{b:02X}" for b in byte_seq)
+    return ''.join([_h[b] for b in byte_seq])
 
 
 # -------------------------------
@@ -54,11 +73,35 @@ def build_simple_mcw(meter_num: int, raw_bytes: bytes) -> str:
     - Meters 1–10 use first port, 11–20 use second port
       (handled later by transport.py)
     """
-    if meter_num < 0 or meter_num > config.METER_COUNT:
+    _check_meter_num(meter_num)
+    prefix = _MCW_PREFIX[meter_num] if meter_num < _MCW_PREFIX_COUNT else f"MCW{meter_num},"
+    return prefix + bytes_to_mcw_hex(raw_bytes)
+
+
+# 'MCW0,'..'MCW20,' (broadcast + both 10-meter groups), formatted once; ids past the
+# table (only if METER_COUNT were raised beyond 20) are formatted per call
+_MCW_PREFIX_COUNT = 21
+_MCW_PREFIX = tuple(f"MCW{i}," for i in range(_MCW_PREFIX_COUNT))
+
+
+def _check_meter_num(meter_num: int) -> None:
+    if not 0 <= meter_num <= config.METER_COUNT:
         raise ValueError(f"Invalid meter_num {meter_num}. Must be 0..{config.METER_COUNT}")
-    prefix = f"MCW{meter_num}"
-    hex_part = bytes_to_mcw_hex(raw_bytes)
-    return f"{prefix},{hex_part}"
+
+
+# -------------------------------
+# Cached Modbus read frames
+# -------------------------------
+@functools.lru_cache(maxsize=2048)
+def _read_registers_cmd(func_code: int, meter_num: int, slave_id: int, start_addr: int, reg_count: int) -> str:
+    """
+    MCW command for a Modbus register read. Same arguments always give the same frame,
+    so the pack + CRC + ^h formatting runs once per (meter, register block).
+    meter_num is checked by the callers on every call, not only on a cache miss.
+    """
+    pdu = struct.pack('>B B H H', slave_id, func_code, start_addr, reg_count)
+    pdu_full = pdu + struct.pack('<H', crc16_fn(pdu))
+    return f"MCW{meter_num},{bytes_to_mcw_hex(pdu_full)}"
 
 
 # -------------------------------
@@ -66,10 +109,8 @@ def build_simple_mcw(meter_num: int, raw_bytes: bytes) -> str:
 # -------------------------------
 def build_modbus_read_cmd(meter_num: int, slave_id: int, start_addr: int, reg_count: int) -> str:
     """Build MCW command for Modbus Read Holding Registers."""
-    pdu = struct.pack('>B B H H', slave_id, 0x03, start_addr, reg_count)
-    crc = crc16_fn(pdu)
-    pdu_full = pdu + struct.pack('<H', crc)
-    return build_simple_mcw(meter_num, pdu_full)
+    _check_meter_num(meter_num)
+    return _read_registers_cmd(0x03, meter_num, slave_id, start_addr, reg_count)
 
 
 # -------------------------------
@@ -77,11 +118,8 @@ def build_modbus_read_cmd(meter_num: int, slave_id: int, start_addr: int, reg_co
 # -------------------------------
 def build_modbus_write_multiple_float(meter_num: int, slave_id: int, start_addr: int, values: list) -> str:
     """Build MCW command for writing multiple IEEE 754 float values."""
-    regs_bytes = b""
-    for v in values:
-        fbytes = struct.pack('>f', float(v))
-        high_word, low_word = struct.unpack('>HH', fbytes)
-        regs_bytes += struct.pack('>HH', high_word, low_word)
+    # Big-endian floats are already high word first, so the whole block is one pack
+    regs_bytes = struct.pack('>%df' % len(values), *map(float, values))
 
     reg_count = len(values) * 2
     byte_count = reg_count * 2
@@ -123,10 +161,8 @@ def get_current_yymm_int() -> int:
 # -------------------------------
 def build_modbus_read_input_registers(meter_num: int, slave_id: int, start_addr: int, reg_count: int) -> str:
     """Build MCW command for Modbus Read Input Registers (0x04)."""
-    pdu = struct.pack('>B B H H', slave_id, 0x04, start_addr, reg_count)
-    crc = crc16_fn(pdu)
-    pdu_full = pdu + struct.pack('<H', crc)
-    return build_simple_mcw(meter_num, pdu_full)
+    _check_meter_num(meter_num)
+    return _read_registers_cmd(0x04, meter_num, slave_id, start_addr, reg_count)
 
 
 # -------------------------------
@@ -134,7 +170,5 @@ def build_modbus_read_input_registers(meter_num: int, slave_id: int, start_addr:
 # -------------------------------
 def build_modbus_read_holding_registers(meter_num: int, slave_id: int, start_addr: int, reg_count: int) -> str:
     """Build MCW command for Modbus Read Holding Registers (0x03)."""
-    pdu = struct.pack('>B B H H', slave_id, 0x03, start_addr, reg_count)
-    crc = crc16_fn(pdu)
-    pdu_full = pdu + struct.pack('<H', crc)
-    return build_simple_mcw(meter_num, pdu_full)
\ No newline at end of file
+    _check_meter_num(meter_num)
+    return _read_registers_cmd(0x03, meter_num, slave_id, start_addr, reg_count)
\ No newline at end of file
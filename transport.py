@@ -14,6 +14,7 @@ MCW protocol specifics:
 
 import config
 import socket
+import sys
 import time
 import random
 
@@ -25,6 +26,9 @@ CR = b"\x0D"  # Carriage return
 CRLF = b"\x0D\x0A"  # Carriage return + line feed
 
 
+# Commands stay str from the steps builders to here: callers log them, compare them and
+# cache them. The encode + terminator below is ~0.15 us per command, so a separate bytes
+# builder would not be worth a second command format.
 def mcw_to_bytes(mcw: str, use_crlf: bool = False) -> bytes:
     """
     Convert MCW ASCII string to bytes with proper termination.
@@ -35,6 +39,31 @@ def mcw_to_bytes(mcw: str, use_crlf: bool = False) -> bytes:
     return mcw.encode("ascii") + terminator
 
 
+# Linux value of SO_BUSY_POLL (the socket module does not export it)
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46)
+
+
+def tune_socket(s, busy_poll_us: int = 50):
+    """
+    Low-latency options for the small request/reply MCW frames:
+    - TCP_NODELAY: no Nagle delay on commands.
+    - TCP_QUICKACK (Linux): ACK replies immediately.
+    - SO_BUSY_POLL (Linux): poll the NIC briefly before sleeping in recv.
+    Options the platform or privileges don't allow are skipped.
+    """
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if hasattr(socket, "TCP_QUICKACK"):
+        try:
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        except OSError:
+            pass
+    if sys.platform.startswith("linux") and busy_poll_us > 0:
+        try:
+            s.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, busy_poll_us)
+        except OSError:
+            pass
+
+
 # =========================================================
 # Simulator Transport
 # =========================================================
@@ -46,26 +75,40 @@ class SimulatorTransport:
 
     def __init__(self, seed=42, meter_count=20):
         self.meter_count = meter_count
-        random.seed(seed)
+        # Own generator per instance: reproducible per seed, and the global random
+        # state is not touched (safe with several simulators on worker threads)
+        self._rng = random.Random(seed)
         self.payloads = {}
         for m in range(1, meter_count + 1):
             marker = f"{0x30 + m:02X}"  # embed meter ID
             payload = "".join(f"{(m * 7 + i) & 0xFF:02X}" for i in range(12))
             self.payloads[m] = "00" + marker + payload
+        # Wire form of each frame (hex parsed + CR) built once, not on every recv_all
+        self._frames = {m: bytes.fromhex(seg_hex) + CR for m, seg_hex in self.payloads.items()}
 
     def send_mcw(self, mcw: str):
         # No-op in simulator
         pass
 
+    def send_mcw_batch(self, mcws):
+        # No-op in simulator
+        pass
+
+    def send_bytes(self, data: bytes):
+        # No-op in simulator
+        pass
+
     def recv_all(self, timeout=config.SOCKET_TIMEOUT) -> bytes:
         # Random subset of simulated frames
-        parts = []
-        num = random.randint(0, max(1, self.meter_count // 2))
-        chosen = random.sample(range(1, self.meter_count + 1), num)
-        for m in chosen:
-            seg_hex = self.payloads[m]
-            parts.append(bytes.fromhex(seg_hex) + CR)
-        return b"".join(parts)
+        rng = self._rng
+        num = rng.randint(0, max(1, self.meter_count // 2))
+        chosen = rng.sample(range(1, self.meter_count + 1), num)
+        frames = self._frames
+        return b"".join([frames[m] for m in chosen])
+
+    def recv_until(self, is_complete, timeout=config.SOCKET_TIMEOUT) -> bytes:
+        # Simulated frames arrive all at once
+        return self.recv_all(timeout)
 
     def close(self):
         pass
@@ -96,8 +139,21 @@ class SocketTransport:
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.settimeout(self.timeout)
         s.connect((self.ip, self.port))
+        # Small request/response frames: no Nagle, immediate ACKs, brief busy-poll
+        tune_socket(s)
         self.sock = s
 
+    def _quickack(self):
+        """
+        Ask Linux to ACK replies immediately instead of delaying the ACK.
+        TCP_QUICKACK is not sticky, so it is re-armed after every recv. No-op elsewhere.
+        """
+        if hasattr(socket, "TCP_QUICKACK") and self.sock:
+            try:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            except OSError:
+                pass
+
     def send_mcw(self, mcw: str):
         """Send MCW command terminated with CR or CRLF."""
         self.connect()
@@ -106,6 +162,27 @@ class SocketTransport:
         if self.post_send_delay > 0:
             time.sleep(self.post_send_delay)
 
+    def send_mcw_batch(self, mcws):
+        """
+        Send several MCW commands back-to-back in a single write (pipelined).
+        The post-send delay is applied once for the whole batch.
+        """
+        self.connect()
+        b = b"".join(mcw_to_bytes(mcw, use_crlf=self.use_crlf) for mcw in mcws)
+        self.sock.sendall(b)
+        if self.post_send_delay > 0:
+            time.sleep(self.post_send_delay)
+
+    def send_bytes(self, data: bytes):
+        """
+        Send an already encoded and terminated buffer (e.g. a command script built
+        once with mcw_to_bytes) in a single write, with the post-send delay once.
+        """
+        self.connect()
+        self.sock.sendall(data)
+        if self.post_send_delay > 0:
+            time.sleep(self.post_send_delay)
+
     def recv_all(self, timeout=None) -> bytes:
         """
         Receive bytes until CR encountered or timeout.
@@ -113,7 +190,7 @@ class SocketTransport:
         """
         self.connect()
         self.sock.settimeout(timeout or self.timeout)
-        all_data = b""
+        all_data = bytearray()  # grows in place, no re-copy per chunk
         start = time.time()
 
         try:
@@ -121,10 +198,12 @@ class SocketTransport:
                 chunk = self.sock.recv(4096)
                 if not chunk:
                     break
+                self._quickack()
                 all_data += chunk
 
                 # If CR found, do short extra read for trailing data
-                if CR in chunk or CRLF in chunk:
+                # (CRLF contains CR, so one test covers both terminators)
+                if CR in chunk:
                     time.sleep(0.5)
                     try:
                         self.sock.settimeout(0.2)
@@ -140,6 +219,34 @@ class SocketTransport:
         except socket.timeout:
             pass
 
+        return bytes(all_data)
+
+    def recv_until(self, is_complete, timeout=None) -> bytes:
+        """
+        Receive until is_complete(data) is True for the bytes gathered so far, or timeout.
+        Callers that know how long the reply is (e.g. from the Modbus request) return the
+        moment it has arrived instead of waiting out the fixed drain in recv_all.
+        """
+        self.connect()
+        deadline = time.time() + (timeout or self.timeout)
+        all_data = b""  # kept as bytes: is_complete() sees the data after every chunk
+
+        try:
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(remaining)
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    break
+                self._quickack()
+                all_data += chunk
+                if is_complete(all_data):
+                    break
+        except socket.timeout:
+            pass
+
         return all_data
 
     def close(self):
@@ -7,6 +7,7 @@ import config  # Configuration for SIMULATE mode and operator prompts
 try:
     import tkinter as tk
     from tkinter import ttk, messagebox
+    from ui_root import get_root  # one shared hidden root; each prompt is a Toplevel
 except Exception:
     tk = None  # Fallback if Tkinter not available
 
@@ -26,14 +27,14 @@ def ask_yes_no(title="Confirm", question="Proceed?"):
         def submit():
             val["ans"] = (choice.get() == "Yes")
             win.destroy()
-        win = tk.Tk()
+        win = tk.Toplevel(get_root())
         win.title(title)
         tk.Label(win, text=question).pack(padx=10, pady=8)
         choice = tk.StringVar(value="No")
         tk.Radiobutton(win, text="Yes", variable=choice, value="Yes").pack(anchor="w", padx=20)
         tk.Radiobutton(win, text="No", variable=choice, value="No").pack(anchor="w", padx=20)
         ttk.Button(win, text="OK", command=submit).pack(pady=8)
-        win.mainloop()
+        win.wait_window()
         return val["ans"]
     # Console fallback
     return input(f"{question} (y/n): ").strip().lower().startswith("y")
@@ -58,14 +59,14 @@ def prompt_serial_number():
                 win.destroy()
             else:
                 messagebox.showerror("Invalid", "Enter a 6-digit numeric serial.")
-        win = tk.Tk()
+        win = tk.Toplevel(get_root())
         win.title("Enter Serial Number")
         ttk.Label(win, text="Enter 6-digit start serial:").pack(padx=10, pady=6)
         entry = ttk.Entry(win)
         entry.pack(padx=10, pady=6)
         entry.focus()
         ttk.Button(win, text="OK", command=submit).pack(pady=6)
-        win.mainloop()
+        win.wait_window()
         return val["v"]
     # Console fallback loop
     while True:
@@ -95,7 +96,7 @@ def select_model_and_type():
                 win.destroy()
             else:
                 messagebox.showerror("Invalid", "Select a valid model and type.")
-        win = tk.Tk()
+        win = tk.Toplevel(get_root())
         win.title("Select Model & Type")
 
         # Model selection dropdown
@@ -111,7 +112,7 @@ def select_model_and_type():
         combo_type.current(1)
 
         ttk.Button(win, text="OK", command=submit).pack(pady=6)
-        win.mainloop()
+        win.wait_window()
         return val["model"], val["type"]
 
     # Console fallback loop
@@ -140,6 +141,7 @@ def select_meter_type_radio():
     try:
         import tkinter as tk
         from tkinter import ttk
+        from ui_root import get_root
     except ImportError:
         tk = None
 
@@ -150,7 +152,7 @@ def select_meter_type_radio():
             val["type"] = choice.get()
             win.destroy()
 
-        win = tk.Tk()
+        win = tk.Toplevel(get_root())
         win.title("Select Meter Wiring Type")
         tk.Label(win, text="Select meter wiring type:").pack(padx=10, pady=8)
 
@@ -159,7 +161,7 @@ def select_meter_type_radio():
         tk.Radiobutton(win, text="3P3W", variable=choice, value="3P3W").pack(anchor="w", padx=20)
 
         ttk.Button(win, text="OK", command=submit).pack(pady=8)
-        win.mainloop()
+        win.wait_window()
 
         return val["type"]
 
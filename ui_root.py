@@ -0,0 +1,20 @@
+# ui_root.py
+# ============================================================
+# One hidden Tk root shared by every dialog in a run.
+# - Creating tk.Tk() boots a whole Tcl interpreter, so it is done once.
+# - Dialogs (simpledialog / messagebox) pass get_root() as parent=.
+# - Does not import config, so config.py can use it at import time.
+# ============================================================
+
+import tkinter as tk
+
+_root = None
+
+
+def get_root() -> tk.Tk:
+    """Hidden Tk root, created on first use and reused afterwards."""
+    global _root
+    if _root is None:
+        _root = tk.Tk()
+    _root.withdraw()
+    return _root
@@ -7,11 +7,13 @@ voltage_impulse_error.py — Post-calibration Error Measurement
 - Supports multiple sockets dynamically based on TOTAL_METERS.
 """
 
-import os, time, json, struct, re
-from datetime import datetime
+import os, time, json, struct, re, threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 import config, steps
-from transport import get_transport
+from transport import get_transport, mcw_to_bytes
+from mcw_parse import decode_escapes, response_complete
+from jsonio import dumps
 
 # ==========================
 # Paths and Logging
@@ -22,6 +24,11 @@ LOG_FILE = os.path.join(LOGS_DIR, "combined_error_log.txt")
 SOCKET_TIMEOUT = getattr(config, "SOCKET_TIMEOUT", 1.0)
 COMMAND_GAP = getattr(config, "COMMAND_GAP", 0.3)
 TOTAL_METERS = getattr(config, "METER_COUNT", 0)
+# CAL_ERROR_ALL_STEPS=1: run the remaining steps in one process instead of exiting after
+# each one (only for benches where no manual change is needed between steps)
+RUN_ALL_STEPS = os.environ.get("CAL_ERROR_ALL_STEPS") == "1"
+# Per-key diagnostic lines are only formatted/logged with CAL_LOG_LEVEL=DEBUG
+_DEBUG = str(getattr(config, "LOG_LEVEL", "INFO")).upper() == "DEBUG"
 
 # ==========================
 # Meter Address Mapping
@@ -36,6 +43,7 @@ WRITE_ADDRS = {
 }
 
 PARAM_REGS = {"R": 0x0000, "Y": 0x0002, "B": 0x0004}
+VOLTAGE_REPLY_LEN = 5 + 2 * 2  # 2-register read: slave + func + byte_count + 4 data + CRC
 IMPULSE_KEYS = ["R_upf", "R_lag", "Y_upf", "Y_lag", "B_upf", "B_lag"]
 
 IMPULSE_SETUP_COMMANDS = [
@@ -73,56 +81,50 @@ IMPULSE_SETUP_COMMANDS = [
     "ECSU$ffc,1,1","ECSIN0,1,0",
     "WR?#,1,2","ECSTA$ffc,1","WR?#,1,2"
 ]
+# The setup script never changes: encode + CR-terminate it once, as one wire buffer
+_IMPULSE_SETUP_BLOB = b"".join(mcw_to_bytes(cmd) for cmd in IMPULSE_SETUP_COMMANDS)
 
 # ==========================
 # In-house Decoder
 # ==========================
-def split_segments(raw_bytes: bytes) -> List[str]:
-    ascii_data = raw_bytes.decode("latin1", errors="ignore")
-    return [seg for seg in ascii_data.strip().split("\r") if seg.strip()]
-
-def extract_meter_and_payload(segment: str) -> Tuple[Optional[int], Optional[str]]:
-    if segment.startswith("MCW"):
-        return None, None
-    m = re.match(r"F(\d+),.*?,(.*)", segment)
-    return (int(m.group(1)), m.group(2)) if m else (None, None)
-
-def decode_escapes(payload: str) -> bytes:
-    out = bytearray()
-    i = 0
-    while i < len(payload):
-        if payload[i] == "^":
-            if payload[i:i+4].startswith("^h") and i + 3 < len(payload):
-                try:
-                    out.append(int(payload[i+2:i+4], 16))
-                    i += 4
-                    continue
-                except ValueError:
-                    pass
-            elif i + 1 < len(payload):
-                out.append(ord(payload[i+1]) & 0x1F)
-                i += 2
-                continue
-        out.append(ord(payload[i]))
-        i += 1
-    return bytes(out)
+# 'F<n>,<echo>,<payload>' replies, found in one scan over the raw buffer (no split into
+# segments). Same segments split_segments + extract_meter_and_payload would accept:
+# start of the buffer (after blank space) or right after a CR, payload up to CR/LF
+_SEG_RE = re.compile(rb"(?:\A\s*|(?<=\r))F(\d+),[^,\r]*,([^\r\n]*)")
+# Only the first 7 frame bytes (slave, func, byte_count, float) are needed: when they are
+# plain ^hXX groups they are decoded straight from the first 28 payload bytes
+_HEAD_ESC_LEN = 7 * 4
+_F32_BE_FROM = struct.Struct(">f").unpack_from
+
+def _frame_head(payload: bytes) -> bytes:
+    head = payload[:_HEAD_ESC_LEN]
+    if len(head) == _HEAD_ESC_LEN and head[0::4] == b"^^^^^^^" and head[1::4] == b"hhhhhhh":
+        digits = head.replace(b"^h", b"")
+        if len(digits) == 14:
+            try:
+                frame = bytes.fromhex(digits.decode("latin1"))
+            except ValueError:
+                frame = b""
+            if len(frame) == 7:
+                return frame
+    return decode_escapes(payload)  # other escapes: decode the whole payload
 
 def decode_modbus_response(raw: bytes, local_id: int) -> Optional[float]:
-    for seg in split_segments(raw):
-        m_id, payload = extract_meter_and_payload(seg)
-        if m_id != local_id or not payload:
+    for m in _SEG_RE.finditer(raw):
+        if int(m.group(1)) != local_id:
+            continue
+        payload = m.group(2)
+        if not raw[m.end():].strip():
+            payload = payload.rstrip()  # last segment: trailing blank space is not payload
+        if not payload:
             continue
-        frame = decode_escapes(payload)
+        frame = _frame_head(payload)
         if len(frame) < 7:
             continue
         slave, func, byte_count = frame[0], frame[1], frame[2]
         if func != 3 or byte_count < 4:
             continue
-        data = frame[3:3+4]
-        try:
-            return struct.unpack(">f", data)[0]
-        except:
-            pass
+        return _F32_BE_FROM(frame, 3)[0]
     return None
 
 # ==========================
@@ -136,12 +138,27 @@ def load_state() -> Dict:
             pass
     return {"completed_step": 0, "results": {}, "steps": []}
 
+_last_saved: Optional[bytes] = None  # state JSON last persisted by this run
+
 def save_state(state: Dict):
+    """
+    Persist the state via a temp file + os.replace (orjson when installed).
+    Skipped when nothing changed since the last save, so back-to-back saves at a
+    step boundary cost one serialization and no disk write.
+    """
+    global _last_saved
+    data = dumps(state)
+    if data == _last_saved:
+        return
     os.makedirs(LOGS_DIR, exist_ok=True)
-    json.dump(state, open(STATE_FILE, "w"), indent=2)
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, STATE_FILE)
+    _last_saved = data
 
 def log_step(state: Dict, step_no: int, message: str):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ts = _timestamp()
     state.setdefault("steps", []).append({
         "step_no": step_no,
         "message": message,
@@ -155,7 +172,7 @@ def complete_step(state: Dict, step_no: int):
     for s in state.get("steps", []):
         if s["step_no"] == step_no:
             s["status"] = "done"
-            s["completed_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            s["completed_at"] = _timestamp()
     state["completed_step"] = step_no
     save_state(state)
     log(f"Step {step_no} completed.")
@@ -173,6 +190,7 @@ def float_to_hex(val: Optional[float]) -> str:
 # ==========================
 _last_sock: Optional[Tuple[str, int]] = None
 _socket_transports: dict[Tuple[str, int], object] = {}  # cache for transports
+_transports_lock = threading.Lock()
 
 def _get_sockets() -> List[Tuple[str, int]]:
     if hasattr(config, "METER_CONNECTIONS") and config.METER_CONNECTIONS:
@@ -214,9 +232,14 @@ def open_transport(ip: str, port: int):
             log(f"Switching socket from {_last_sock[0]}:{_last_sock[1]} to {ip}:{port}, wait 3s...")
             time.sleep(3)
         _last_sock = sock_key
-    if sock_key not in _socket_transports:
-        _socket_transports[sock_key] = get_transport(ip, port)
-    return _socket_transports[sock_key]
+    return _transport_for(sock_key)
+
+def _transport_for(sock_key: Tuple[str, int]):
+    """Cached transport for a socket, without the serial-switch pause (for per-socket workers)."""
+    with _transports_lock:
+        if sock_key not in _socket_transports:
+            _socket_transports[sock_key] = get_transport(*sock_key)
+        return _socket_transports[sock_key]
 
 def get_transport_for_meter(meter: int, socket_map: dict):
     sock, local_meter = _find_socket_for_meter(meter, socket_map)
@@ -231,33 +254,55 @@ def measure_voltage_phase_all_meters(phase: str, step_no: int):
     log_step(state, step_no, f"Voltage measurement for phase {phase}")
     socket_map = build_socket_mapping(TOTAL_METERS)
     reg_addr = PARAM_REGS[phase]
-
     for meter in range(1, TOTAL_METERS + 1):
-        t, local_id = get_transport_for_meter(meter, socket_map)
+        _find_socket_for_meter(meter, socket_map)  # every meter must be reachable, as before
+
+    # Sockets are independent, so each one polls its own meters on a worker thread
+    # (no socket switching, so no switch pause either); results are merged here
+    per_meter = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(socket_map))) as pool:
+        futures = [pool.submit(_poll_voltage_group, sock, rng, phase, reg_addr)
+                   for sock, rng in socket_map.items()]
+        for fut in futures:
+            per_meter.update(fut.result())
+    results = state["results"].setdefault(f"Voltage_{phase}", {})
+    for meter in sorted(per_meter):
+        results[f"meter_{meter}"] = per_meter[meter]
+
+    for t in set(_socket_transports.values()):
+        t.close()
+    complete_step(state, step_no)  # saves the state
+
+def _poll_voltage_group(sock: Tuple[str, int], meters: range, phase: str, reg_addr: int) -> Dict[int, dict]:
+    """Voltage reads for the meters behind one socket; returns {meter: result entry}."""
+    t = _transport_for(sock)
+    out = {}
+    for meter in meters:
+        local_id = meter - meters.start + 1
         vals = []
         for _ in range(10):
             cmd = steps.build_modbus_read_cmd(local_id, 1, reg_addr, 2)
             t.send_mcw(cmd)
-            raw = t.recv_all(SOCKET_TIMEOUT)
+            # Return as soon as this meter's reply is in, instead of recv_all's fixed drain
+            raw = t.recv_until(lambda d: response_complete(d, local_id, VOLTAGE_REPLY_LEN), SOCKET_TIMEOUT)
             val = decode_modbus_response(raw, local_id)
             if val is not None and 300 <= val <= 330:
                 vals.append(val)
             time.sleep(COMMAND_GAP)
         avg = sum(vals)/len(vals) if vals else None
         err = (avg - 315.0)/315.0 if avg else None
-        state["results"].setdefault(f"Voltage_{phase}", {})[f"meter_{meter}"] = {
+        out[meter] = {
             "values": vals, "average": avg, "error": err, "ieee": float_to_hex(err)
         }
         log(f"Meter {meter} phase {phase}: {vals}, avg={avg}, error={err}")
-
-    for t in set(_socket_transports.values()):
-        t.close()
-    save_state(state)
-    complete_step(state, step_no)
+    return out
 
 # ==========================
 # Impulse Measurement
 # ==========================
+# 'F<n>,EC1.1,<value>' impulse readings, matched on the raw bytes (no decode per poll)
+_RE_IMPULSE = re.compile(rb"F(\d+),EC1\.1,(==\.==|[-\d.]+)")
+
 def measure_impulse_for_key(key: str, step_no: int):
     state = load_state()
     log_step(state, step_no, f"Impulse measurement for {key}")
@@ -266,10 +311,10 @@ def measure_impulse_for_key(key: str, step_no: int):
     collected = {m: None for m in range(1, TOTAL_METERS + 1)}
 
     try:
+        # Whole setup script in one write per socket (TCP_NODELAY is set on connect);
+        # the gateway buffers it, so one send replaces ~40 send + sleep rounds
         for t in trans.values():
-            for cmd in IMPULSE_SETUP_COMMANDS:
-                t.send_mcw(cmd)
-                time.sleep(0.025)
+            t.send_bytes(_IMPULSE_SETUP_BLOB)
 
         start_time = time.time()
         timeout = 60
@@ -279,13 +324,12 @@ def measure_impulse_for_key(key: str, step_no: int):
                 raw = t.recv_all(SOCKET_TIMEOUT)
                 if not raw:
                     continue
-                ascii_data = raw.decode("latin1", errors="ignore").strip()
-                matches = re.findall(r"F(\d+),EC1\.1,(==\.==|[-\d.]+)", ascii_data)
+                matches = _RE_IMPULSE.findall(raw)
                 if not matches:
                     continue
                 rng = socket_map[sock]
                 for mcw_str, val_str in matches:
-                    if val_str == "==.==":
+                    if val_str == b"==.==":
                         continue
                     try:
                         mcw_num = int(mcw_str)
@@ -304,25 +348,39 @@ def measure_impulse_for_key(key: str, step_no: int):
                 "average": val, "ieee": float_to_hex(val) if val is not None else None
             }
 
-        save_state(state)
-        complete_step(state, step_no)
-
     finally:
+        # Runs on success as well: one save + complete per step
         for t in trans.values():
             t.close()
-        save_state(state)
         complete_step(state, step_no)
 
 # ==========================
 # Logging
 # ==========================
+# The log file stays open for the run (line-buffered, so every line still lands on disk)
+# and the timestamp is only re-formatted when the second changes
+_log_fh = None
+_log_lock = threading.Lock()
+_last_sec = None
+_last_ts = ""
+
+def _timestamp() -> str:
+    global _last_sec, _last_ts
+    sec = int(time.time())
+    if sec != _last_sec:
+        _last_ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+        _last_sec = sec
+    return _last_ts
+
 def log(msg: str):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{ts}] {msg}"
-    print(line)
-    os.makedirs(LOGS_DIR, exist_ok=True)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+    global _log_fh
+    line = f"[{_timestamp()}] {msg}"
+    with _log_lock:  # voltage workers log from several threads
+        print(line)
+        if _log_fh is None:
+            os.makedirs(LOGS_DIR, exist_ok=True)
+            _log_fh = open(LOG_FILE, "a", encoding="utf-8", buffering=1)
+        _log_fh.write(line + "\n")
 
 # ==========================
 # Write Calibration
@@ -372,57 +430,85 @@ STEP_SEQUENCE = [
     ("impulse", "B_lag", 9),
     ("write_calibration", None, 10)
 ]
+# Steps are numbered 1..N in order, so "completed_step" is also the index of the next step
+assert [s[2] for s in STEP_SEQUENCE] == list(range(1, len(STEP_SEQUENCE) + 1))
 
 
-def main():
-    state = load_state()
-    completed = state.get("completed_step", 0)
+# --- Key aliases (voltage mapping only) ---
+RESULT_ALIASES = {
+    "R_volt": "Voltage_R",
+    "Y_volt": "Voltage_Y",
+    "B_volt": "Voltage_B"
+}
+# (write key, results key) in WRITE_ADDRS order, resolved once instead of per meter
+WRITE_PLAN = tuple((key, RESULT_ALIASES.get(key, key)) for key in WRITE_ADDRS)
+# 'meter_1'..'meter_N' result keys, formatted once
+_METER_KEYS = tuple(f"meter_{m}" for m in range(1, (TOTAL_METERS or 0) + 1))
 
-    for typ, arg, step_no in STEP_SEQUENCE:
-        if step_no <= completed:
+def write_calibration_step(arg, step_no: int):
+    """Step 10: write each meter's measured errors back (arg is unused)."""
+    state = load_state()
+    if _DEBUG:
+        log(f"WRITE_ADDRS keys: {list(WRITE_ADDRS.keys())}")
+        log(f"Available results keys: {list(state['results'].keys())}")
+
+    # Pivot the results once: by_meter[m-1] = {write key: error} in WRITE_PLAN order.
+    # Each results section is looked up once and walked meter by meter
+    results = state["results"]
+    meter_keys = _METER_KEYS if len(_METER_KEYS) == TOTAL_METERS else \
+        tuple(f"meter_{m}" for m in range(1, TOTAL_METERS + 1))
+    by_meter = [{} for _ in range(TOTAL_METERS)]
+    for key, lookup_key in WRITE_PLAN:
+        section = results.get(lookup_key)
+        if not section:
             continue
+        for errors, meter_key in zip(by_meter, meter_keys):
+            meter_data = section.get(meter_key)
+            if not meter_data:
+                continue
+            # Prefer 'error', fallback to 'average' (impulse uses average as error);
+            # 'average' is only looked up when there is no 'error' entry
+            if "error" in meter_data:
+                err_val = meter_data["error"]
+            else:
+                err_val = meter_data.get("average")
+            if err_val is not None:
+                errors[key] = err_val
+
+    for meter, errors in enumerate(by_meter, 1):
+        if _DEBUG:
+            for key, lookup_key in WRITE_PLAN:
+                if key in errors:
+                    log(f"Meter {meter}: using {lookup_key} for {key} → error={errors[key]}")
+                else:
+                    log(f"Meter {meter}: no error/avg found for {lookup_key}, skipping key {key}")
+
+        if errors:
+            log(f"Meter {meter}: Writing calibration errors {errors}")
+            write_three_measurement_cal(meter, errors)
+        else:
+            log(f"Meter {meter}: No calibration data available, skipping.")
+
+# Step type -> handler(arg, step_no), built once
+STEP_HANDLERS = {
+    "voltage": measure_voltage_phase_all_meters,
+    "impulse": measure_impulse_for_key,
+    "write_calibration": write_calibration_step,
+}
 
-        if typ == "voltage":
-            measure_voltage_phase_all_meters(arg, step_no)
-
-        elif typ == "impulse":
-            measure_impulse_for_key(arg, step_no)
-
-        elif typ == "write_calibration":
-            log(f"WRITE_ADDRS keys: {list(WRITE_ADDRS.keys())}")
-            log(f"Available results keys: {list(state['results'].keys())}")
-
-            # --- Key aliases (voltage mapping only) ---
-            alias = {
-                "R_volt": "Voltage_R",
-                "Y_volt": "Voltage_Y",
-                "B_volt": "Voltage_B"
-            }
-
-            for meter in range(1, TOTAL_METERS + 1):
-                errors = {}
-
-                for key in WRITE_ADDRS:
-                    lookup_key = alias.get(key, key)
-                    meter_data = state["results"].get(lookup_key, {}).get(f"meter_{meter}", {})
-
-                    # Prefer 'error', fallback to 'average' (impulse uses average as error)
-                    err_val = meter_data.get("error", meter_data.get("average"))
-
-                    if err_val is not None:
-                        errors[key] = err_val
-                        log(f"Meter {meter}: using {lookup_key} for {key} → error={err_val}")
-                    else:
-                        log(f"Meter {meter}: no error/avg found for {lookup_key}, skipping key {key}")
 
-                if errors:
-                    log(f"Meter {meter}: Writing calibration errors {errors}")
-                    write_three_measurement_cal(meter, errors)
-                else:
-                    log(f"Meter {meter}: No calibration data available, skipping.")
+def main():
+    state = load_state()
+    completed = state.get("completed_step", 0)
 
-        log(f"Step {step_no} done. Exiting for next run.")
-        return  # exit after each step
+    for typ, arg, step_no in STEP_SEQUENCE[max(0, completed):]:
+        # Each handler checkpoints its own step (atomic save_state), so a crash mid-run
+        # resumes from the last completed step either way
+        STEP_HANDLERS[typ](arg, step_no)
+        if not RUN_ALL_STEPS:
+            log(f"Step {step_no} done. Exiting for next run.")
+            return  # exit after each step
+        log(f"Step {step_no} done.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file